@@ -10,16 +10,15 @@ from pynput import keyboard
 import json
 import traceback
 import websockets
-import queue
-from pydub import AudioSegment
-from pydub.playback import play
 import time
 import wave
 import tempfile
+import shutil
 from datetime import datetime
 import cv2
 import base64
 import platform
+from urllib.parse import urlencode
 from interpreter import (
     interpreter,
 )  # Just for code execution. Maybe we should let people do from interpreter.computer import run?
@@ -38,6 +37,10 @@ os.environ["STT_RUNNER"] = "server"
 os.environ["TTS_RUNNER"] = "server"
 
 from ..utils.accumulator import Accumulator
+from ..utils import audio_frames
+from ..utils import audio
+from ..utils.ring_buffer import JitterBuffer, RingBuffer
+from ..utils.send_queue import SendQueue
 
 accumulator = Accumulator()
 
@@ -45,9 +48,17 @@ accumulator = Accumulator()
 CHUNK = 1024  # Record in chunks of 1024 samples
 FORMAT = pyaudio.paInt16  # 16 bits per sample
 CHANNELS = 1  # Mono
-RATE = 44100  # Sample rate
+RATE = 44100  # Sample rate, for microphones that can't record at 16kHz
 RECORDING = False  # Flag to control recording state
 SPACEBAR_PRESSED = False  # Flag to track spacebar press state
+# Shorter recordings are just a press, which means "stop"
+MIN_RECORDING_SECONDS = 0.3
+# A recording starts this long before the press, so the first syllable isn't cut
+RECORDING_PREROLL_MS = int(os.getenv("RECORDING_PREROLL_MS", 300))
+# How much the microphone keeps, for the pre-roll and in case reading falls behind
+CAPTURE_BUFFER_SECONDS = 5
+# Send the recording while it's being recorded, so the server can transcribe along
+STREAM_RECORDING = os.getenv("STREAM_RECORDING", "True").lower() == "true"
 
 # Camera configuration
 CAMERA_ENABLED = os.getenv("CAMERA_ENABLED", False)
@@ -56,6 +67,24 @@ if type(CAMERA_ENABLED) == str:
 CAMERA_DEVICE_INDEX = int(os.getenv("CAMERA_DEVICE_INDEX", 0))
 CAMERA_WARMUP_SECONDS = float(os.getenv("CAMERA_WARMUP_SECONDS", 0))
 
+# The server keeps one session (and conversation) per device ID
+DEVICE_ID = os.getenv("DEVICE_ID", platform.node())
+
+# What we'd rather send recordings in ("wav", or "opus" if ffmpeg is installed).
+# Either way they're 16kHz mono, which is all STT needs
+AUDIO_INPUT_FORMAT = os.getenv("AUDIO_INPUT_FORMAT", "wav").lower()
+OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")
+
+# Replies start playing once this much of their audio is in
+PLAYBACK_PREBUFFER_MS = int(os.getenv("PLAYBACK_PREBUFFER_MS", 120))
+# Audio received ahead of what's playing, beyond this the server has to wait
+PLAYBACK_BUFFER_SECONDS = int(os.getenv("PLAYBACK_BUFFER_SECONDS", 30))
+PLAYBACK_FRAMES_PER_BUFFER = audio_frames.SAMPLE_RATE * 20 // 1000
+
+# How we ask the server to frame the audio it sends us ("framed" or "raw")
+AUDIO_FRAMING = os.getenv("AUDIO_FRAMING", "framed")
+AUDIO_FRAME_MS = int(os.getenv("AUDIO_FRAME_MS", audio_frames.DEFAULT_FRAME_MS))
+
 # Specify OS
 current_platform = get_system_info()
 is_win10 = lambda: platform.system() == "Windows" and "10" in platform.version()
@@ -63,15 +92,52 @@ is_win10 = lambda: platform.system() == "Windows" and "10" in platform.version()
 # Initialize PyAudio
 p = pyaudio.PyAudio()
 
-send_queue = queue.Queue()
+send_queue = SendQueue()
+
+
+def recording_rate():
+    """16kHz if the microphone can record at it, else it's resampled from RATE."""
+    try:
+        p.is_format_supported(
+            audio.SAMPLE_RATE,
+            input_device=p.get_default_input_device_info()["index"],
+            input_channels=CHANNELS,
+            input_format=FORMAT,
+        )
+    except (ValueError, OSError):
+        return RATE
+    return audio.SAMPLE_RATE
+
+
+def offered_input_formats():
+    """The recording formats we offer the server, best first."""
+    if AUDIO_INPUT_FORMAT == "opus":
+        if shutil.which("ffmpeg"):
+            return ["bytes.opus", "bytes.wav"]
+        logger.warning("Recording in WAV, Opus needs ffmpeg")
+    return ["bytes.wav"]
 
 
 class Device:
     def __init__(self):
         self.pressed_keys = set()
         self.captured_images = []
-        self.audiosegments = []
+        bytes_per_second = audio_frames.SAMPLE_RATE * audio_frames.SAMPLE_WIDTH
+        self.player = JitterBuffer(
+            PLAYBACK_BUFFER_SECONDS * bytes_per_second,
+            PLAYBACK_PREBUFFER_MS * bytes_per_second // 1000,
+        )
+        self.output_stream = None
+
+        # The microphone is always on, recordings read from what it captured
+        self.capture_rate = None
+        self.microphone = None
+        self.input_stream = None
+        self.captured = threading.Event()
+        self.pressed = threading.Event()
+        self.chunk = bytearray(CHUNK * 2)
         self.server_url = ""
+        self.audio_settings = audio_frames.RAW
 
     def fetch_image_from_camera(self, camera_index=CAMERA_DEVICE_INDEX):
         """Captures an image from the specified camera device and saves it to a temporary file. Adds the image to the captured_images list."""
@@ -131,25 +197,90 @@ class Device:
             self.add_image_to_send_queue(image_path)
         self.captured_images.clear()  # Clear the list after sending
 
-    async def play_audiosegments(self):
-        """Plays them sequentially."""
+    def start_playback(self):
+        """Opens the one output stream every reply is played on, as it arrives."""
+        out = bytearray(PLAYBACK_FRAMES_PER_BUFFER * audio_frames.SAMPLE_WIDTH)
+
+        def callback(in_data, frame_count, time_info, status):
+            size = frame_count * audio_frames.SAMPLE_WIDTH
+            buffer = out if len(out) == size else bytearray(size)
+            self.player.fill(buffer)
+            return bytes(buffer), pyaudio.paContinue
+
+        self.output_stream = p.open(
+            format=FORMAT,
+            channels=audio_frames.CHANNELS,
+            rate=audio_frames.SAMPLE_RATE,
+            output=True,
+            frames_per_buffer=PLAYBACK_FRAMES_PER_BUFFER,
+            stream_callback=callback,
+        )
+
+    def start_capture(self):
+        """
+        Opens the one input stream every recording is read from, and the thread
+        that records them.
+        """
+        self.capture_rate = recording_rate()
+        self.microphone = RingBuffer(CAPTURE_BUFFER_SECONDS * self.capture_rate * 2)
+
+        def callback(in_data, frame_count, time_info, status):
+            self.microphone.write(in_data, overwrite=True)
+            self.captured.set()
+            return None, pyaudio.paContinue
+
+        self.input_stream = p.open(
+            format=FORMAT,
+            channels=CHANNELS,
+            rate=self.capture_rate,
+            input=True,
+            frames_per_buffer=CHUNK,
+            stream_callback=callback,
+        )
+        threading.Thread(target=self.recorder, daemon=True).start()
+
+    def recorder(self):
         while True:
+            self.pressed.wait()
+            self.pressed.clear()
             try:
-                for audio in self.audiosegments:
-                    play(audio)
-                    self.audiosegments.remove(audio)
-                await asyncio.sleep(0.1)
-            except asyncio.exceptions.CancelledError:
-                # This happens once at the start?
-                pass
+                self.record_audio()
             except:
                 logger.info(traceback.format_exc())
 
+    def read_microphone(self):
+        """
+        Waits for captured audio and returns a view of it, which is only valid
+        until the next read. Once the recording has stopped and everything up to
+        then has been read, returns an empty view.
+        """
+        while True:
+            self.captured.clear()
+            count = self.microphone.read_into(self.chunk)
+            if count or not RECORDING:
+                return memoryview(self.chunk)[:count]
+            self.captured.wait(0.1)
+
+    async def play(self, pcm):
+        """Queues 16kHz mono s16le for the speaker."""
+        pcm = memoryview(pcm)
+        while pcm:
+            pcm = pcm[self.player.write(pcm) :]
+            if pcm:
+                # Full, so the server waits until some of it has been played
+                await self.player.wait_for_space()
+
     def record_audio(self):
+        streaming = os.getenv("STT_RUNNER") == "server" and STREAM_RECORDING
+        # Files are always WAV, streams are what we agreed on with the server
+        input_format = "bytes.wav"
+        if streaming:
+            input_format = self.audio_settings.get("input_format", input_format)
+
         if os.getenv("STT_RUNNER") == "server":
             # STT will happen on the server. we're sending audio.
             send_queue.put(
-                {"role": "user", "type": "audio", "format": "bytes.wav", "start": True}
+                {"role": "user", "type": "audio", "format": input_format, "start": True}
             )
         elif os.getenv("STT_RUNNER") == "client":
             # STT will happen here, on the client. we're sending text.
@@ -158,15 +289,23 @@ class Device:
             raise Exception("STT_RUNNER must be set to either 'client' or 'server'.")
 
         """Record audio from the microphone and add it to the queue."""
-        stream = p.open(
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=RATE,
-            input=True,
-            frames_per_buffer=CHUNK,
-        )
+        rate = self.capture_rate
+        # Start a moment before the press, which doesn't count towards its length
+        preroll = self.microphone.keep_last(RECORDING_PREROLL_MS * rate // 1000 * 2)
+        min_seconds = MIN_RECORDING_SECONDS + preroll / 2 / rate
         print("Recording started...")
-        global RECORDING
+
+        if streaming:
+            streamed = self.stream_recording(rate, input_format, min_seconds)
+            print("Recording stopped.")
+            if not streamed:
+                self.send_stop(input_format)
+            send_queue.put(
+                {"role": "user", "type": "audio", "format": input_format, "end": True}
+            )
+            return
+
+        resampler = audio.StreamResampler(rate) if rate != audio.SAMPLE_RATE else None
 
         # Create a temporary WAV file to store the audio data
         temp_dir = tempfile.gettempdir()
@@ -176,32 +315,27 @@ class Device:
         wav_file = wave.open(wav_path, "wb")
         wav_file.setnchannels(CHANNELS)
         wav_file.setsampwidth(p.get_sample_size(FORMAT))
-        wav_file.setframerate(RATE)
+        wav_file.setframerate(audio.SAMPLE_RATE)
 
-        while RECORDING:
-            data = stream.read(CHUNK, exception_on_overflow=False)
-            wav_file.writeframes(data)
+        while True:
+            data = self.read_microphone()
+            if not data:
+                break
+            wav_file.writeframes(resampler.feed(data) if resampler else data)
+        if resampler:
+            wav_file.writeframes(resampler.flush())
 
         wav_file.close()
-        stream.stop_stream()
-        stream.close()
         print("Recording stopped.")
 
-        duration = wav_file.getnframes() / RATE
-        if duration < 0.3:
+        duration = wav_file.getnframes() / audio.SAMPLE_RATE
+        if duration < min_seconds:
             # Just pressed it. Send stop message
             if os.getenv("STT_RUNNER") == "client":
                 send_queue.put({"role": "user", "type": "message", "content": "stop"})
                 send_queue.put({"role": "user", "type": "message", "end": True})
             else:
-                send_queue.put(
-                    {
-                        "role": "user",
-                        "type": "audio",
-                        "format": "bytes.wav",
-                        "content": "",
-                    }
-                )
+                self.send_stop()
                 send_queue.put(
                     {
                         "role": "user",
@@ -241,6 +375,57 @@ class Device:
         if os.path.exists(wav_path):
             os.remove(wav_path)
 
+    def stream_recording(self, rate, input_format, min_seconds):
+        """
+        Sends audio to the server as it's captured, as 16kHz mono in
+        `input_format`: a WAV that doesn't know its size yet, or Ogg Opus. The
+        first `min_seconds` are held back, in case this is just a press. Returns
+        whether anything was sent.
+        """
+        resampler = audio.StreamResampler(rate) if rate != audio.SAMPLE_RATE else None
+        held_back = []
+        frames = 0
+        while True:
+            captured = self.read_microphone()
+            if not captured:
+                break
+            frames += len(captured) // 2
+            data = resampler.feed(captured) if resampler else bytes(captured)
+            if held_back is None:
+                self.send_recorded(encoder, data)
+                continue
+
+            held_back.append(data)
+            if frames >= min_seconds * rate:
+                self.queue_all_captured_images()
+                if input_format == "bytes.opus":
+                    encoder = audio.OpusEncoder(OPUS_BITRATE)
+                else:
+                    encoder = None
+                    send_queue.put(audio.wav_header())
+                for data in held_back:
+                    self.send_recorded(encoder, data)
+                held_back = None
+
+        if held_back is not None:
+            return False
+        if resampler:
+            self.send_recorded(encoder, resampler.flush())
+        if encoder:
+            send_queue.put(encoder.flush())
+        return True
+
+    def send_recorded(self, encoder, pcm):
+        data = encoder.feed(pcm) if encoder else pcm
+        if data:
+            send_queue.put(data)
+
+    def send_stop(self, input_format="bytes.wav"):
+        """Sends an empty recording, which the server takes as "stop"."""
+        send_queue.put(
+            {"role": "user", "type": "audio", "format": input_format, "content": ""}
+        )
+
     def toggle_recording(self, state):
         """Toggle the recording state."""
         global RECORDING, SPACEBAR_PRESSED
@@ -248,7 +433,7 @@ class Device:
             SPACEBAR_PRESSED = True
             if not RECORDING:
                 RECORDING = True
-                threading.Thread(target=self.record_audio).start()
+                self.pressed.set()
         elif not state and SPACEBAR_PRESSED:
             SPACEBAR_PRESSED = False
             RECORDING = False
@@ -277,15 +462,11 @@ class Device:
 
     async def message_sender(self, websocket):
         while True:
-            message = await asyncio.get_event_loop().run_in_executor(
-                None, send_queue.get
-            )
+            message = await send_queue.get()
             if isinstance(message, bytes):
                 await websocket.send(message)
             else:
                 await websocket.send(json.dumps(message))
-            send_queue.task_done()
-            await asyncio.sleep(0.01)
 
     async def websocket_communication(self, WS_URL):
         show_connection_log = True
@@ -298,16 +479,56 @@ class Device:
             else:
                 print("\nHold the spacebar to start recording. Press CTRL-C to exit.")
 
+            # Until the server answers, audio comes the original way
+            self.audio_settings = audio_frames.RAW
+            await websocket.send(
+                json.dumps(
+                    {
+                        "role": "client",
+                        "type": "config",
+                        "content": {
+                            "audio_framing": AUDIO_FRAMING,
+                            "frame_ms": AUDIO_FRAME_MS,
+                            "input_formats": offered_input_formats(),
+                        },
+                    }
+                )
+            )
+
             asyncio.create_task(self.message_sender(websocket))
 
             while True:
-                await asyncio.sleep(0.01)
                 chunk = await websocket.recv()
 
                 logger.debug(f"Got this message from the server: {type(chunk)} {chunk}")
 
                 if type(chunk) == str:
                     chunk = json.loads(chunk)
+                    if chunk.get("role") == "server" and chunk.get("type") == "config":
+                        self.audio_settings = chunk["content"]
+                        continue
+                    if (
+                        chunk.get("role") == "server"
+                        and chunk.get("type") == "transcript"
+                    ):
+                        # What the server has heard so far
+                        logger.info(f"> {chunk['content']}")
+                        continue
+                    if (
+                        chunk.get("role") == "assistant"
+                        and chunk.get("type") == "audio"
+                    ):
+                        # Replies' audio goes straight to the speaker
+                        if "start" in chunk:
+                            self.player.begin()
+                        elif "end" in chunk:
+                            self.player.end()
+                        continue
+                else:
+                    if self.audio_settings["audio_framing"] == "framed":
+                        _, chunk = audio_frames.unpack(chunk)
+                    await self.play(chunk)
+                    continue
 
                 message = accumulator.accumulate(chunk)
                 if message == None:
@@ -316,25 +537,6 @@ class Device:
 
                 # At this point, we have our message
 
-                if message["type"] == "audio" and message["format"].startswith("bytes"):
-                    # Convert bytes to audio file
-
-                    audio_bytes = message["content"]
-
-                    # Create an AudioSegment instance with the raw data
-                    audio = AudioSegment(
-                        # raw audio data (bytes)
-                        data=audio_bytes,
-                        # signed 16-bit little-endian format
-                        sample_width=2,
-                        # 16,000 Hz frame rate
-                        frame_rate=16000,
-                        # mono sound
-                        channels=1,
-                    )
-
-                    self.audiosegments.append(audio)
-
                 # Run the code if that's the client's job
                 if os.getenv("CODE_RUNNER") == "client":
                     if message["type"] == "code" and "end" in message:
@@ -366,7 +568,7 @@ class Device:
 
     async def start_async(self):
         # Configuration for WebSocket
-        WS_URL = f"ws://{self.server_url}"
+        WS_URL = f"ws://{self.server_url}/?{urlencode({'device_id': DEVICE_ID})}"
         # Start the WebSocket communication
         asyncio.create_task(self.websocket_communication(WS_URL))
 
@@ -374,7 +576,8 @@ class Device:
         if os.getenv("CODE_RUNNER") == "client":
             asyncio.create_task(put_kernel_messages_into_queue(send_queue))
 
-        asyncio.create_task(self.play_audiosegments())
+        self.start_playback()
+        self.start_capture()
 
         # If Raspberry Pi, add the button listener, otherwise use the spacebar
         if current_platform.startswith("raspberry-pi"):
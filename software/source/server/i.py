@@ -5,7 +5,6 @@ load_dotenv()  # take environment variables from .env.
 
 import glob
 import time
-import json
 from interpreter import OpenInterpreter
 import shutil
 
@@ -355,12 +354,4 @@ def configure_interpreter(interpreter: OpenInterpreter):
     # interpreter.offline = True
     interpreter.id = 206  # Used to identify itself to other interpreters. This should be changed programmatically so it's unique.
 
-    ### RESET conversations/user.json
-    app_dir = user_data_dir("01")
-    conversations_dir = os.path.join(app_dir, "conversations")
-    os.makedirs(conversations_dir, exist_ok=True)
-    user_json_path = os.path.join(conversations_dir, "user.json")
-    with open(user_json_path, "w") as file:
-        json.dump([], file)
-
     return interpreter
@@ -5,23 +5,33 @@ load_dotenv()  # take environment variables from .env.
 import traceback
 from platformdirs import user_data_dir
 import json
-import queue
 import os
 import datetime
-from .utils.bytes_to_wav import bytes_to_wav
-import re
 from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.websockets import WebSocket, WebSocketDisconnect
 import asyncio
+import functools
+import shutil
+import inspect
 from .utils.kernel import put_kernel_messages_into_queue
+from .utils.async_stream import iterate_in_thread
+from .utils.sentences import SentenceSegmenter
+from .utils.tts_pipeline import TtsPipeline
+from .utils.tts_cache import TtsCache
+from .utils import streaming_stt
+from .utils import vad
+from .utils.scheduler import FairScheduler, ProcessService
+from .utils import scheduler
 from .i import configure_interpreter
-from interpreter import interpreter
-from ..utils.accumulator import Accumulator
+from interpreter import interpreter, OpenInterpreter
+from .session import SessionRegistry, close_conversation_store
 from .utils.logs import setup_logging
 from .utils.logs import logger
 
 from ..utils.print_markdown import print_markdown
+from ..utils import audio_frames
+from ..utils import audio
 
 os.environ["STT_RUNNER"] = "server"
 os.environ["TTS_RUNNER"] = "server"
@@ -38,35 +48,28 @@ print("")
 
 setup_logging()
 
-accumulator = Accumulator()
-
 app = FastAPI()
 
 app_dir = user_data_dir("01")
-conversation_history_path = os.path.join(app_dir, "conversations", "user.json")
 
 SERVER_LOCAL_PORT = int(os.getenv("SERVER_LOCAL_PORT", 10001))
 
+# Devices may record in Opus if there's an ffmpeg here to decode it
+INPUT_FORMATS = ["bytes.wav"]
+if shutil.which("ffmpeg"):
+    INPUT_FORMATS.append("bytes.opus")
 
-# This is so we only say() full sentences
-def is_full_sentence(text):
-    return text.endswith((".", "!", "?"))
-
+# Every session's STT and TTS calls take turns on these
+stt_scheduler = FairScheduler("stt", scheduler.STT_WORKERS)
+tts_scheduler = FairScheduler("tts", scheduler.TTS_WORKERS)
 
-def split_into_sentences(text):
-    return re.split(r"(?<=[.!?])\s+", text)
 
+# Switch code executor to device if that's set
 
-# Queues
-from_computer = (
-    queue.Queue()
-)  # Just for computer messages from the device. Sync queue because interpreter.run is synchronous
-from_user = asyncio.Queue()  # Just for user messages from the device.
-to_device = asyncio.Queue()  # For messages we send.
 
-# Switch code executor to device if that's set
+def device_python_language(session):
+    """Builds a Python language for `session` that runs code on its device."""
 
-if os.getenv("CODE_RUNNER") == "device":
     # (This should probably just loop through all languages and apply these changes instead)
 
     class Python:
@@ -88,29 +91,32 @@ if os.getenv("CODE_RUNNER") == "device":
             }
 
             # Unless it was just sent to the device, send it wrapped in flags
-            if not (interpreter.messages and interpreter.messages[-1] == message):
-                to_device.put(
+            messages = session.interpreter.messages
+            if not (messages and messages[-1] == message):
+                session.loop.call_soon_threadsafe(
+                    session.to_device.put_nowait,
                     {
                         "role": "assistant",
                         "type": "code",
                         "format": "python",
                         "start": True,
-                    }
+                    },
                 )
-                to_device.put(message)
-                to_device.put(
+                session.loop.call_soon_threadsafe(session.to_device.put_nowait, message)
+                session.loop.call_soon_threadsafe(
+                    session.to_device.put_nowait,
                     {
                         "role": "assistant",
                         "type": "code",
                         "format": "python",
                         "end": True,
-                    }
+                    },
                 )
 
             # Stream the response
             logger.info("Waiting for the device to respond...")
             while True:
-                chunk = from_computer.get()
+                chunk = session.from_computer.get()
                 logger.info(f"Server received from device: {chunk}")
                 if "end" in chunk:
                     break
@@ -124,27 +130,87 @@ if os.getenv("CODE_RUNNER") == "device":
             # dramatic!! do nothing
             pass
 
-    interpreter.computer.languages = [Python]
+    return Python
+
 
 # Configure interpreter
 interpreter = configure_interpreter(interpreter)
 
 
+def create_interpreter(session):
+    """
+    Every session gets its own interpreter, configured like the global one.
+    The LLM service has already been applied to the global interpreter in main().
+    """
+    session_interpreter = OpenInterpreter()
+
+    if os.getenv("CODE_RUNNER") == "device":
+        session_interpreter.computer.languages = [device_python_language(session)]
+
+    session_interpreter = configure_interpreter(session_interpreter)
+
+    session_interpreter.system_message = interpreter.system_message
+    session_interpreter.offline = interpreter.offline
+    for key, value in vars(interpreter.llm).items():
+        if key != "interpreter":
+            setattr(session_interpreter.llm, key, value)
+
+    # Let skills (like `schedule`) know which device they are talking to
+    session_interpreter.computer.run(
+        language="python",
+        code=f"import os\nos.environ['DEVICE_SESSION_ID'] = {session.id!r}",
+        display=session_interpreter.verbose,
+    )
+
+    return session_interpreter
+
+
+def start_session(session):
+    session.start(
+        listener(session),
+        # Start watching the kernel if it's your job to do that
+        # (in the future, code can run on device. for now, just server.)
+        put_kernel_messages_into_queue(session.from_computer),
+    )
+
+
+sessions = SessionRegistry(create_interpreter, start_session)
+
+
 @app.get("/ping")
 async def ping():
     return PlainTextResponse("pong")
 
 
+@app.get("/status")
+async def status():
+    return {
+        "sessions": len(list(sessions)),
+        "stt": stt_scheduler.status(),
+        "tts": tts_scheduler.status(),
+    }
+
+
 @app.websocket("/")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    receive_task = asyncio.create_task(receive_messages(websocket))
-    send_task = asyncio.create_task(send_messages(websocket))
+    # Devices that send an ID get their session (and conversation) back on reconnect
+    session = await sessions.connect(websocket.query_params.get("device_id"))
+    receive_task = asyncio.create_task(receive_messages(websocket, session))
+    send_task = asyncio.create_task(send_messages(websocket, session))
     try:
-        await asyncio.gather(receive_task, send_task)
+        done, pending = await asyncio.wait(
+            [receive_task, send_task], return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
     except Exception as e:
         logger.debug(traceback.format_exc())
         logger.info(f"Connection lost. Error: {e}")
+    finally:
+        sessions.disconnect(session)
 
 
 @app.post("/")
@@ -152,14 +218,29 @@ async def add_computer_message(request: Request):
     body = await request.json()
     text = body.get("text")
     if not text:
-        return {"error": "Missing 'text' in request body"}, 422
+        return JSONResponse(
+            {"error": "Missing 'text' in request body"}, status_code=422
+        )
+
+    # Without a session ID, the message goes to every session
+    session_id = body.get("session_id")
+    if session_id:
+        if session_id not in sessions:
+            return JSONResponse(
+                {"error": f"Unknown session '{session_id}'"}, status_code=404
+            )
+        targets = [sessions.get(session_id)]
+    else:
+        targets = list(sessions)
+
     message = {"role": "user", "type": "message", "content": text}
-    await from_user.put({"role": "user", "type": "message", "start": True})
-    await from_user.put(message)
-    await from_user.put({"role": "user", "type": "message", "end": True})
+    for session in targets:
+        await session.from_user.put({"role": "user", "type": "message", "start": True})
+        await session.from_user.put(dict(message))
+        await session.from_user.put({"role": "user", "type": "message", "end": True})
 
 
-async def receive_messages(websocket: WebSocket):
+async def receive_messages(websocket: WebSocket, session):
     while True:
         try:
             try:
@@ -167,22 +248,45 @@ async def receive_messages(websocket: WebSocket):
             except Exception as e:
                 print(str(e))
                 return
+            if data["type"] == "websocket.disconnect":
+                return
             if "text" in data:
                 try:
                     data = json.loads(data["text"])
                     if data["role"] == "computer":
-                        from_computer.put(
+                        session.from_computer.put(
                             data
                         )  # To be handled by interpreter.computer.run
                     elif data["role"] == "user":
-                        await from_user.put(data)
+                        if streaming_stt.STREAMING and is_streamable_audio(data):
+                            await stream_audio_to_stt(session, data)
+                        else:
+                            await session.from_user.put(data)
+                    elif data["role"] == "client" and data["type"] == "config":
+                        # The device tells us how it wants its audio, we tell it what it gets
+                        session.audio_settings = audio_frames.negotiate(
+                            data.get("content", {}), INPUT_FORMATS
+                        )
+                        await session.to_device.put(
+                            {
+                                "role": "server",
+                                "type": "config",
+                                "content": session.audio_settings,
+                            }
+                        )
                     else:
                         raise ("Unknown role:", data)
                 except json.JSONDecodeError:
                     pass  # data is not JSON, leave it as is
             elif "bytes" in data:
                 data = data["bytes"]  # binary data
-                await from_user.put(data)
+                if session.transcriber and session.transcriber.streaming:
+                    try:
+                        session.transcriber.feed(data)
+                    except audio.UnsupportedAudio as e:
+                        await stop_streaming_stt(session, e)
+                else:
+                    await session.from_user.put(data)
         except WebSocketDisconnect as e:
             if e.code == 1000:
                 logger.info("Websocket connection closed normally.")
@@ -191,9 +295,80 @@ async def receive_messages(websocket: WebSocket):
                 raise
 
 
-async def send_messages(websocket: WebSocket):
+def is_streamable_audio(message):
+    return (
+        message.get("type") == "audio"
+        and message.get("format") in streaming_stt.STREAMABLE_FORMATS
+    )
+
+
+async def stream_audio_to_stt(session, flag):
+    """
+    Transcribes the device's recording as it comes in, instead of leaving it to
+    the listener, and hands the listener the text once the recording ends.
+    """
+    if "start" in flag:
+        session.transcriber = streaming_stt.StreamingTranscriber(
+            lambda pcm: stt_scheduler.run(session.id, stt, pcm, "audio/raw"),
+            lambda text: send_transcript(session, text, "partial"),
+            flag,
+        )
+        return
+
+    if "end" not in flag or session.transcriber is None:
+        return
+    transcriber, session.transcriber = session.transcriber, None
+    if not transcriber.streaming:
+        # The listener has the rest of the recording, and transcribes it
+        await session.from_user.put(flag)
+        return
+    # Waiting for the last segments mustn't hold up the device's next messages
+    (session.finishing_transcript,) = session.start(
+        finish_streaming_stt(session, transcriber, session.finishing_transcript)
+    )
+
+
+async def stop_streaming_stt(session, error):
+    """
+    The recording is in a format that can't be converted as it arrives, so the
+    listener gets all of it instead, like audio that can't be streamed.
+    """
+    logger.warning(f"Can't transcribe this recording as it arrives: {error}")
+    transcriber = session.transcriber
+    await session.from_user.put(transcriber.flag)
+    await session.from_user.put(transcriber.unconverted)
+
+
+async def finish_streaming_stt(session, transcriber, previous):
+    """
+    Hands the listener the recording's text once it's all transcribed, after
+    the text of the recording before it.
+    """
+    text = await transcriber.finish()
+    print("> ", text)
+    send_transcript(session, text, "final")
+
+    if previous is not None:
+        await asyncio.wait([previous])
+    if not text:
+        return
+    for chunk in (
+        {"role": "user", "type": "message", "start": True},
+        {"role": "user", "type": "message", "content": text},
+        {"role": "user", "type": "message", "end": True},
+    ):
+        await session.from_user.put(chunk)
+
+
+def send_transcript(session, text, format):
+    session.to_device.put_nowait(
+        {"role": "server", "type": "transcript", "format": format, "content": text}
+    )
+
+
+async def send_messages(websocket: WebSocket, session):
     while True:
-        message = await to_device.get()
+        message = await session.to_device.get()
         # print(f"Sending to the device: {type(message)} {str(message)[:100]}")
 
         try:
@@ -205,23 +380,19 @@ async def send_messages(websocket: WebSocket):
                 raise TypeError("Message must be a dict or bytes")
         except:
             # Make sure to put the message back in the queue if you failed to send it
-            await to_device.put(message)
+            session.to_device.requeue(message)
             raise
 
 
-async def listener():
+async def listener(session):
+    interpreter = session.interpreter
+    conversation = session.conversation
+
     while True:
         try:
-            while True:
-                if not from_user.empty():
-                    chunk = await from_user.get()
-                    break
-                elif not from_computer.empty():
-                    chunk = from_computer.get()
-                    break
-                await asyncio.sleep(1)
+            chunk = await session.next_input()
 
-            message = accumulator.accumulate(chunk)
+            message = session.accumulator.accumulate(chunk)
             if message == None:
                 # Will be None until we have a full message ready
                 continue
@@ -238,19 +409,21 @@ async def listener():
                 ):  # If it was nothing / silence / empty
                     continue
 
-                # Convert bytes to audio file
                 # Format will be bytes.wav or bytes.opus
                 mime_type = "audio/" + message["format"].split(".")[1]
-                audio_file_path = bytes_to_wav(message["content"], mime_type)
-
-                # For microphone debugging:
-                if False:
-                    os.system(f"open {audio_file_path}")
-                    import time
+                pcm = await asyncio.to_thread(
+                    audio.to_16k_pcm, message["content"], mime_type
+                )
 
-                    time.sleep(15)
+                # Only the speech goes to STT, and nothing at all if there is none
+                speech, seconds = vad.trim(pcm)
+                logger.info(
+                    f"Heard {seconds:.1f}s of speech in {len(pcm) / 2 / audio.SAMPLE_RATE:.1f}s of audio"
+                )
+                if not speech:
+                    continue
 
-                text = stt(audio_file_path)
+                text = await stt_scheduler.run(session.id, stt, speech, "audio/raw")
                 print("> ", text)
                 message = {"role": "user", "type": "message", "content": text}
 
@@ -264,14 +437,19 @@ async def listener():
             if message["content"].lower().strip(".,! ") == "stop":
                 continue
 
-            # Load, append, and save conversation history
-            with open(conversation_history_path, "r") as file:
-                messages = json.load(file)
-            messages.append(message)
-            with open(conversation_history_path, "w") as file:
-                json.dump(messages, file, indent=4)
-
-            accumulated_text = ""
+            # Append to conversation history. The interpreter appends to the list it
+            # gets, so it gets its own copy
+            conversation.append(message)
+            messages = [dict(m) for m in conversation.messages]
+
+            segmenter = SentenceSegmenter()
+            pipeline = None
+            if os.getenv("TTS_RUNNER") == "server":
+                # Synthesizes upcoming sentences while earlier ones are being sent
+                pipeline = TtsPipeline(
+                    functools.partial(synthesize, session),
+                    lambda chunks: send_audio_to_device(session, chunks),
+                )
 
             if any(
                 [m["type"] == "image" for m in messages]
@@ -279,85 +457,86 @@ async def listener():
                 interpreter.llm.model = "gpt-4-vision-preview"
                 interpreter.llm.supports_vision = True
 
-            for chunk in interpreter.chat(messages, stream=True, display=True):
-                if any([m["type"] == "image" for m in interpreter.messages]):
-                    interpreter.llm.model = "gpt-4-vision-preview"
-
-                logger.debug("Got chunk:", chunk)
-
-                # Send it to the user
-                await to_device.put(chunk)
-                # Yield to the event loop, so you actually send it out
-                await asyncio.sleep(0.01)
-
-                if os.getenv("TTS_RUNNER") == "server":
-                    # Speak full sentences out loud
-                    if (
-                        chunk["role"] == "assistant"
-                        and "content" in chunk
-                        and chunk["type"] == "message"
-                    ):
-                        accumulated_text += chunk["content"]
-                        sentences = split_into_sentences(accumulated_text)
-
-                        # If we're going to speak, say we're going to stop sending text.
-                        # This should be fixed probably, we should be able to do both in parallel, or only one.
-                        if any(is_full_sentence(sentence) for sentence in sentences):
-                            await to_device.put(
-                                {"role": "assistant", "type": "message", "end": True}
-                            )
-
-                        if is_full_sentence(sentences[-1]):
-                            for sentence in sentences:
-                                await stream_tts_to_device(sentence)
-                            accumulated_text = ""
+            # The interpreter thinks and runs code in its own thread, so we can keep
+            # receiving audio and serving other sessions in the meantime
+            chunks = iterate_in_thread(
+                interpreter.chat, messages, stream=True, display=True
+            )
+            try:
+                async for chunk in chunks:
+                    if any([m["type"] == "image" for m in interpreter.messages]):
+                        interpreter.llm.model = "gpt-4-vision-preview"
+
+                    logger.debug("Got chunk:", chunk)
+
+                    # Send it to the user
+                    await session.to_device.put(chunk)
+
+                    if pipeline:
+                        # Speak full sentences out loud. Text keeps streaming alongside
+                        # the audio, devices accumulate the two separately
+                        if (
+                            chunk["role"] == "assistant"
+                            and "content" in chunk
+                            and chunk["type"] == "message"
+                        ):
+                            for sentence in segmenter.feed(chunk["content"]):
+                                await stream_tts_to_device(pipeline, sentence)
+
+                        elif (
+                            chunk["role"] == "assistant"
+                            and chunk["type"] == "message"
+                            and "end" in chunk
+                        ):
+                            # Say whatever is left of the message, even without a period
+                            for sentence in segmenter.flush():
+                                await stream_tts_to_device(pipeline, sentence)
+
+                    # If we have a new message, save our progress and go back to the top
+                    if not session.from_user.empty():
+                        # Check if it's just an end flag. We ignore those.
+                        temp_message = await session.from_user.get()
+
+                        if (
+                            type(temp_message) is dict
+                            and temp_message.get("role") == "user"
+                            and temp_message.get("end")
+                        ):
+                            # Yup. False alarm.
+                            continue
                         else:
-                            for sentence in sentences[:-1]:
-                                await stream_tts_to_device(sentence)
-                            accumulated_text = sentences[-1]
-
-                        # If we're going to speak, say we're going to stop sending text.
-                        # This should be fixed probably, we should be able to do both in parallel, or only one.
-                        if any(is_full_sentence(sentence) for sentence in sentences):
-                            await to_device.put(
-                                {"role": "assistant", "type": "message", "start": True}
-                            )
-
-                # If we have a new message, save our progress and go back to the top
-                if not from_user.empty():
-                    # Check if it's just an end flag. We ignore those.
-                    temp_message = await from_user.get()
-
-                    if (
-                        type(temp_message) is dict
-                        and temp_message.get("role") == "user"
-                        and temp_message.get("end")
-                    ):
-                        # Yup. False alarm.
-                        continue
-                    else:
-                        # Whoops! Put that back
-                        await from_user.put(temp_message)
+                            # Whoops! Put that back
+                            await session.from_user.put(temp_message)
 
-                    with open(conversation_history_path, "w") as file:
-                        json.dump(interpreter.messages, file, indent=4)
+                        conversation.sync(interpreter.messages)
 
-                    # TODO: is triggering seemingly randomly
-                    # logger.info("New user message recieved. Breaking.")
-                    # break
+                        # TODO: is triggering seemingly randomly
+                        # logger.info("New user message recieved. Breaking.")
+                        # break
 
-                # Also check if there's any new computer messages
-                if not from_computer.empty():
-                    with open(conversation_history_path, "w") as file:
-                        json.dump(interpreter.messages, file, indent=4)
+                    # Also check if there's any new computer messages
+                    if not session.from_computer.empty():
+                        conversation.sync(interpreter.messages)
 
-                    logger.info("New computer message recieved. Breaking.")
-                    break
+                        logger.info("New computer message recieved. Breaking.")
+                        break
+            except BaseException:
+                if pipeline:
+                    pipeline.cancel()
+                    pipeline = None
+                raise
+            finally:
+                await chunks.aclose()
+                # Save the interpreter's side of the turn too
+                conversation.sync(interpreter.messages)
+                if pipeline:
+                    # Let the rest of the reply finish speaking before the next turn
+                    await pipeline.close()
         except:
             traceback.print_exc()
 
 
-async def stream_tts_to_device(sentence):
+async def stream_tts_to_device(pipeline, sentence):
     force_task_completion_responses = [
         "the task is done",
         "the task is impossible",
@@ -366,26 +545,50 @@ async def stream_tts_to_device(sentence):
     if sentence.lower().strip().strip(".!?").strip() in force_task_completion_responses:
         return
 
-    for chunk in stream_tts(sentence):
-        await to_device.put(chunk)
+    await pipeline.say(sentence)
 
 
-def stream_tts(sentence):
-    audio_file = tts(sentence)
+async def synthesize(session, sentence, urgent=False):
+    """Yields the 16kHz mono s16le audio of a sentence."""
+    audio_bytes = await asyncio.to_thread(tts_cache.get, sentence)
+    if audio_bytes is not None:
+        yield audio_bytes
+        return
 
-    with open(audio_file, "rb") as f:
-        audio_bytes = f.read()
-    os.remove(audio_file)
+    if tts_stream:
+        # Pass audio on as it's synthesized, and cache it once it's all there
+        stream = tts_scheduler.stream(session.id, tts_stream, sentence, urgent=urgent)
+        chunks = []
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+        await asyncio.to_thread(tts_cache.put, sentence, b"".join(chunks))
+        return
+
+    audio_bytes = await tts_scheduler.run(session.id, tts, sentence, urgent=urgent)
+    await asyncio.to_thread(tts_cache.put, sentence, audio_bytes)
+    yield audio_bytes
 
+
+async def send_audio_to_device(session, chunks):
+    """Streams one sentence's audio, framed the way the device asked for."""
     file_type = "bytes.raw"
-    chunk_size = 1024
+    framer = audio_frames.Framer(session.audio_settings)
 
-    # Stream the audio
-    yield {"role": "assistant", "type": "audio", "format": file_type, "start": True}
-    for i in range(0, len(audio_bytes), chunk_size):
-        chunk = audio_bytes[i : i + chunk_size]
-        yield chunk
-    yield {"role": "assistant", "type": "audio", "format": file_type, "end": True}
+    await session.to_device.put(
+        {"role": "assistant", "type": "audio", "format": file_type, "start": True}
+    )
+    async for pcm in chunks:
+        for frame in framer.feed(pcm):
+            await session.to_device.put(frame)
+    for frame in framer.flush():
+        await session.to_device.put(frame)
+    await session.to_device.put(
+        {"role": "assistant", "type": "audio", "format": file_type, "end": True}
+    )
 
 
 from uvicorn import Config, Server
@@ -408,6 +611,8 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     print_markdown("*Server is shutting down*")
+    # Let the last messages reach the database
+    await asyncio.to_thread(close_conversation_store)
 
 
 async def main(
@@ -425,6 +630,8 @@ async def main(
 ):
     global HOST
     global PORT
+    global tts_cache
+    global tts_stream
     PORT = server_port
     HOST = server_host
 
@@ -467,18 +674,45 @@ async def main(
         )
 
         ServiceClass = getattr(module, service.capitalize())
-        service_instance = ServiceClass(config)
-        globals()[service] = getattr(service_instance, service)
+        if (
+            service != "llm"
+            and scheduler.EXECUTOR == "process"
+            and not inspect.iscoroutinefunction(getattr(ServiceClass, service))
+        ):
+            # CPU-bound services get a copy in each worker process
+            workers = (stt_scheduler if service == "stt" else tts_scheduler).workers
+            service_instance = ProcessService(
+                module.__name__, ServiceClass.__name__, config, workers
+            )
+            globals()[service] = service_instance.method(service)
+            # Streams can't cross processes, whole sentences are synthesized
+            stream = None
+            voice = service_instance.attribute("voice", "")
+        else:
+            service_instance = ServiceClass(config)
+            globals()[service] = getattr(service_instance, service)
+            # A service with its own pool of workers gets no more calls at once
+            # than that, so the rest wait their turn in the scheduler, not the pool
+            pool_size = getattr(service_instance, "pool_size", None)
+            if service != "llm" and pool_size:
+                (stt_scheduler if service == "stt" else tts_scheduler).limit(pool_size)
+            stream = getattr(service_instance, "stream", None)
+            voice = getattr(service_instance, "voice", "")
+
+        if service == "tts":
+            # Services that can stream their audio let it start playing sooner
+            tts_stream = stream
+
+            # Phrases that come up again are spoken from here instead of synthesized
+            tts_cache = TtsCache(
+                os.path.join(application_directory, "tts_cache"),
+                service=tts_service,
+                voice=voice,
+            )
 
+    # Sessions copy their LLM settings from this interpreter
     interpreter.llm.completions = llm
 
-    # Start listening
-    asyncio.create_task(listener())
-
-    # Start watching the kernel if it's your job to do that
-    if True:  # in the future, code can run on device. for now, just server.
-        asyncio.create_task(put_kernel_messages_into_queue(from_computer))
-
     config = Config(app, host=server_host, port=int(server_port), lifespan="on")
     server = Server(config)
     await server.serve()
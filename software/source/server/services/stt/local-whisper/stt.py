@@ -1,25 +1,54 @@
 """
-Defines a function which takes a path to an audio file and turns it into text.
+Defines a function which takes audio bytes and turns them into text.
 """
 
-from datetime import datetime
 import os
-import contextlib
-import tempfile
+import queue
 import shutil
-import ffmpeg
+import struct
 import subprocess
+import threading
 
 import urllib.request
 
+from source.server.utils.logs import logger
+from source.server.utils.logs import setup_logging
+from source.utils import audio
+
+setup_logging()
+
+# How many transcriptions (each with its own copy of the model) can run at once
+WORKERS = int(os.getenv("WHISPER_WORKERS", 1))
+
+LENGTH = struct.Struct("<I")
+
 
 class Stt:
     def __init__(self, config):
         self.service_directory = config["service_directory"]
         install(self.service_directory)
 
-    def stt(self, audio_file_path):
-        return stt(self.service_directory, audio_file_path)
+        model_name = os.getenv("WHISPER_MODEL_NAME", "ggml-tiny.en.bin")
+        self.command = [
+            os.path.join(
+                self.service_directory,
+                "whisper-rust",
+                "target",
+                "release",
+                "whisper-rust",
+            ),
+            "--model-path",
+            os.path.join(self.service_directory, "model", model_name),
+            "--serve",
+        ]
+        # The model is loaded once per worker, not once per transcription
+        self.pool_size = WORKERS
+        self.workers = queue.Queue()
+        for _ in range(WORKERS):
+            self.workers.put(WhisperWorker(self.command))
+
+    def stt(self, audio_bytes, mime_type="audio/raw"):
+        return stt(self.workers, self.command, audio_bytes, mime_type)
 
 
 def install(service_dir):
@@ -31,15 +60,22 @@ def install(service_dir):
     if not os.path.exists(source_whisper_rust_path):
         print(f"Source directory does not exist: {source_whisper_rust_path}")
         exit(1)
-    if not os.path.exists(WHISPER_RUST_PATH):
-        shutil.copytree(source_whisper_rust_path, WHISPER_RUST_PATH)
+    # Always copied, so changes to the sources get built
+    shutil.copytree(
+        source_whisper_rust_path,
+        WHISPER_RUST_PATH,
+        ignore=shutil.ignore_patterns("target"),
+        dirs_exist_ok=True,
+    )
 
     os.chdir(WHISPER_RUST_PATH)
 
-    # Check if whisper-rust executable exists before attempting to build
-    if not os.path.isfile(
-        os.path.join(WHISPER_RUST_PATH, "target/release/whisper-rust")
-    ):
+    # Check if an up to date whisper-rust executable exists before attempting to build
+    executable = os.path.join(WHISPER_RUST_PATH, "target/release/whisper-rust")
+    up_to_date = os.path.isfile(executable) and os.path.getmtime(
+        executable
+    ) >= newest_source_change(source_whisper_rust_path)
+    if not up_to_date:
         # Check if Rust is installed. Needed to build whisper executable
 
         rustc_path = shutil.which("rustc")
@@ -50,7 +86,7 @@ def install(service_dir):
             )
             exit(1)
 
-        # Build Whisper Rust executable if not found
+        # Build Whisper Rust executable if not found, or out of date
         subprocess.run(["cargo", "build", "--release"], check=True)
     else:
         print("Whisper Rust executable already exists. Skipping build.")
@@ -73,97 +109,75 @@ def install(service_dir):
         print("Whisper model already exists. Skipping download.")
 
 
-def convert_mime_type_to_format(mime_type: str) -> str:
-    if mime_type == "audio/x-wav" or mime_type == "audio/wav":
-        return "wav"
-    if mime_type == "audio/webm":
-        return "webm"
-    if mime_type == "audio/raw":
-        return "dat"
-
-    return mime_type
-
-
-@contextlib.contextmanager
-def export_audio_to_wav_ffmpeg(audio: bytearray, mime_type: str) -> str:
-    temp_dir = tempfile.gettempdir()
-
-    # Create a temporary file with the appropriate extension
-    input_ext = convert_mime_type_to_format(mime_type)
-    input_path = os.path.join(
-        temp_dir, f"input_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.{input_ext}"
-    )
-    with open(input_path, "wb") as f:
-        f.write(audio)
-
-    # Check if the input file exists
-    assert os.path.exists(input_path), f"Input file does not exist: {input_path}"
-
-    # Export to wav
-    output_path = os.path.join(
-        temp_dir, f"output_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.wav"
-    )
-    print(mime_type, input_path, output_path)
-    if mime_type == "audio/raw":
-        ffmpeg.input(
-            input_path,
-            f="s16le",
-            ar="16000",
-            ac=1,
-        ).output(output_path, loglevel="panic").run()
-    else:
-        ffmpeg.input(input_path).output(
-            output_path, acodec="pcm_s16le", ac=1, ar="16k", loglevel="panic"
-        ).run()
-
-    try:
-        yield output_path
-    finally:
-        os.remove(input_path)
-        os.remove(output_path)
-
-
-def run_command(command):
-    result = subprocess.run(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
-    return result.stdout, result.stderr
-
-
-def get_transcription_file(service_directory, wav_file_path: str):
-    local_path = os.path.join(service_directory, "model")
-    whisper_rust_path = os.path.join(
-        service_directory, "whisper-rust", "target", "release"
-    )
-    model_name = os.getenv("WHISPER_MODEL_NAME", "ggml-tiny.en.bin")
-
-    output, _ = run_command(
-        [
-            os.path.join(whisper_rust_path, "whisper-rust"),
-            "--model-path",
-            os.path.join(local_path, model_name),
-            "--file-path",
-            wav_file_path,
-        ]
-    )
-
-    return output
-
-
-def stt_wav(service_directory, wav_file_path: str):
-    temp_dir = tempfile.gettempdir()
-    output_path = os.path.join(
-        temp_dir, f"output_stt_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.wav"
-    )
-    ffmpeg.input(wav_file_path).output(
-        output_path, acodec="pcm_s16le", ac=1, ar="16k"
-    ).run()
+def newest_source_change(directory):
+    newest = 0
+    for root, dirs, files in os.walk(directory):
+        if "target" in dirs:
+            dirs.remove("target")
+        for name in files:
+            newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+    return newest
+
+
+class WhisperWorker:
+    """
+    A long running `whisper-rust --serve` process, which keeps the model loaded.
+    Each request is a u32 byte count and that much 16kHz mono s16le audio on
+    stdin, and gets a u32 byte count and that much text back on stdout.
+    """
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        threading.Thread(target=self._read_log, daemon=True).start()
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def transcribe(self, pcm):
+        try:
+            self.process.stdin.write(LENGTH.pack(len(pcm)))
+            self.process.stdin.write(pcm)
+            self.process.stdin.flush()
+            (length,) = LENGTH.unpack(self._read_exactly(LENGTH.size))
+            text = self._read_exactly(length)
+        except (OSError, EOFError):
+            self.close()
+            raise RuntimeError("Whisper exited")
+        return text.decode(errors="replace")
+
+    def _read_exactly(self, size):
+        # A pipe can return less than asked for, so keep reading until it's all
+        # here, or the process is gone and it never will be
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.process.stdout.read(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def close(self):
+        self.process.kill()
+
+    def _read_log(self):
+        for line in self.process.stderr:
+            logger.debug(f"whisper: {line.decode(errors='replace').rstrip()}")
+
+
+def stt(workers, command, audio_bytes, mime_type="audio/raw"):
+    pcm = audio.to_16k_pcm(audio_bytes, mime_type)
+
+    worker = workers.get()
     try:
-        transcript = get_transcription_file(service_directory, output_path)
+        if not worker.alive:
+            logger.warning("Whisper worker died, starting a new one")
+            worker = WhisperWorker(command)
+        return worker.transcribe(pcm)
     finally:
-        os.remove(output_path)
-    return transcript
-
-
-def stt(service_directory, input_data):
-    return stt_wav(service_directory, input_data)
+        workers.put(worker)
@@ -1,8 +1,9 @@
 mod transcribe;
 
 use clap::Parser;
+use std::io::{Read, Write};
 use std::path::PathBuf;
-use transcribe::transcribe;
+use transcribe::{load_model, transcribe, transcribe_audio};
 
 #[derive(Parser, Debug)]
 #[command(author, version, about, long_about = None)]
@@ -11,15 +12,59 @@ struct Args {
     #[arg(short, long, value_parser, required = true)]
     model_path: PathBuf,
 
-    /// This is the wav audio file that will be converted from speech to text
-    #[arg(short, long, value_parser, required = true)]
+    /// This is the 16KHz mono PCM audio file that will be converted from speech to text, "-" for stdin
+    #[arg(short, long, value_parser, required_unless_present = "serve")]
     file_path: Option<PathBuf>,
+
+    /// Keep the model loaded and transcribe requests from stdin until it closes.
+    /// A request is a u32 (little endian) byte count and that much 16KHz mono
+    /// s16le audio, and each gets a u32 byte count and that much UTF-8 text back.
+    #[arg(long)]
+    serve: bool,
+}
+
+fn serve(model_path: &PathBuf) -> Result<(), String> {
+    let ctx = load_model(model_path)?;
+    let mut state = ctx.create_state().map_err(|_| "failed to create state")?;
+
+    let mut stdin = std::io::stdin().lock();
+    let mut stdout = std::io::stdout().lock();
+    let mut length = [0u8; 4];
+
+    loop {
+        if stdin.read_exact(&mut length).is_err() {
+            // stdin closed, we're done
+            return Ok(());
+        }
+        let mut audio_bytes = vec![0u8; u32::from_le_bytes(length) as usize];
+        stdin
+            .read_exact(&mut audio_bytes)
+            .map_err(|e| format!("failed to read audio: {}", e))?;
+
+        let transcription = transcribe_audio(&mut state, &audio_bytes).unwrap_or_else(|e| {
+            eprintln!("Error: {}", e);
+            String::new()
+        });
+
+        stdout
+            .write_all(&(transcription.len() as u32).to_le_bytes())
+            .and_then(|_| stdout.write_all(transcription.as_bytes()))
+            .and_then(|_| stdout.flush())
+            .map_err(|e| format!("failed to write transcription: {}", e))?;
+    }
 }
 
 fn main() {
 
     let args = Args::parse();
 
+    if args.serve {
+        if let Err(e) = serve(&args.model_path) {
+            panic!("Error: {}", e);
+        }
+        return;
+    }
+
     let file_path = match args.file_path {
         Some(fp) => fp,
         None => panic!("No file path provided")
@@ -1,29 +1,69 @@
-use whisper_rs::{FullParams, SamplingStrategy, WhisperContext, WhisperContextParameters};
+use whisper_rs::{FullParams, SamplingStrategy, WhisperContext, WhisperContextParameters, WhisperState};
+use std::io::Read;
 use std::path::PathBuf;
 
 
+/// Loads a Whisper model.
+///
+/// # Arguments
+/// * `model_path` - Path to Whisper model file
+///
+/// # Returns
+///
+/// A Result containing the loaded model if successful, or an error message if not.
+pub fn load_model(model_path: &PathBuf) -> Result<WhisperContext, String> {
+    let model_path_str = model_path.to_str().expect("Not valid model path");
+    WhisperContext::new_with_params(
+        model_path_str,
+        WhisperContextParameters::default(),
+    )
+    .map_err(|_| "failed to load model".to_string())
+}
+
+
 /// Transcribes the given audio file using the whisper-rs library.
 ///
 /// # Arguments
 /// * `model_path` - Path to Whisper model file
-/// * `file_path` - A string slice that holds the path to the audio file to be transcribed.
+/// * `file_path` - A string slice that holds the path to the audio file to be transcribed, or "-" to read it from stdin.
 ///
 /// # Returns
 ///
 /// A Result containing a String with the transcription if successful, or an error message if not.
 pub fn transcribe(model_path: &PathBuf, file_path: &PathBuf) -> Result<String, String> {
 
-    let model_path_str = model_path.to_str().expect("Not valid model path");
     // Load a context and model
-    let ctx = WhisperContext::new_with_params(
-        model_path_str, // Replace with the actual path to the model
-        WhisperContextParameters::default(),
-    )
-    .map_err(|_| "failed to load model")?;
+    let ctx = load_model(model_path)?;
 
     // Create a state
     let mut state = ctx.create_state().map_err(|_| "failed to create state")?;
 
+    // Load the audio file
+    let audio_bytes = if file_path.as_os_str() == "-" {
+        let mut buffer = Vec::new();
+        std::io::stdin()
+            .read_to_end(&mut buffer)
+            .map_err(|e| format!("failed to read audio from stdin: {}", e))?;
+        buffer
+    } else {
+        std::fs::read(file_path).map_err(|e| format!("failed to read audio file: {}", e))?
+    };
+
+    transcribe_audio(&mut state, &audio_bytes)
+}
+
+
+/// Transcribes 16KHz mono s16le audio with an already loaded model.
+///
+/// # Arguments
+/// * `state` - A state of the loaded model, reused between calls
+/// * `audio_bytes` - The audio to be transcribed
+///
+/// # Returns
+///
+/// A Result containing a String with the transcription if successful, or an error message if not.
+pub fn transcribe_audio(state: &mut WhisperState, audio_bytes: &[u8]) -> Result<String, String> {
+
     // Create a params object
     // Note that currently the only implemented strategy is Greedy, BeamSearch is a WIP
     let mut params = FullParams::new(SamplingStrategy::Greedy { best_of: 1 });
@@ -38,11 +78,9 @@ pub fn transcribe(model_path: &PathBuf, file_path: &PathBuf) -> Result<String, S
     params.set_print_realtime(false);
     params.set_print_timestamps(false);
 
-    // Load the audio file
-    let audio_data = std::fs::read(file_path)
-        .map_err(|e| format!("failed to read audio file: {}", e))?
+    let audio_data = audio_bytes
         .chunks_exact(2)
-        .map(|chunk| i16::from_ne_bytes([chunk[0], chunk[1]]))
+        .map(|chunk| i16::from_le_bytes([chunk[0], chunk[1]]))
         .collect::<Vec<i16>>();
 
     // Convert the audio data to the required format (16KHz mono i16 samples)
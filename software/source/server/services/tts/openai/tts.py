@@ -1,10 +1,9 @@
-import ffmpeg
-import tempfile
-from openai import OpenAI
 import os
 
+from source.server.utils import openai_client
 from source.server.utils.logs import logger
 from source.server.utils.logs import setup_logging
+from source.utils import audio
 
 setup_logging()
 
@@ -18,27 +17,52 @@ if not os.getenv("OPENAI_API_KEY"):
     logger.error("")
     os._exit(1)
 
-client = OpenAI()
+# The rate of the "pcm" response format
+PCM_SAMPLE_RATE = 24000
 
 
 class Tts:
     def __init__(self, config):
-        pass
+        self.voice = os.getenv("OPENAI_VOICE_NAME", "alloy")
 
-    def tts(self, text):
-        response = client.audio.speech.create(
+    async def stream(self, text):
+        """Yields the 16kHz mono s16le audio of `text` as it's downloaded."""
+        response, chunks, first = await openai_client.hedged(
+            lambda: self._open(text), discard=close_response
+        )
+        # 24kHz mono s16le, which only needs resampling for the device
+        resampler = audio.StreamResampler(PCM_SAMPLE_RATE)
+        try:
+            yield resampler.feed(first)
+            async for chunk in chunks:
+                yield resampler.feed(chunk)
+            yield resampler.flush()
+        finally:
+            await close_response((response, chunks, first))
+
+    async def tts(self, text):
+        return b"".join([chunk async for chunk in self.stream(text)])
+
+    async def _open(self, text):
+        """Starts a request, and waits for its first bytes."""
+        response = openai_client.client().audio.speech.with_streaming_response.create(
             model="tts-1",
-            voice=os.getenv("OPENAI_VOICE_NAME", "alloy"),
+            voice=self.voice,
             input=text,
-            response_format="opus",
+            response_format="pcm",
         )
-        with tempfile.NamedTemporaryFile(suffix=".opus", delete=False) as temp_file:
-            response.stream_to_file(temp_file.name)
+        opened = await response.__aenter__()
+        chunks = opened.iter_bytes()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = b""
+        except BaseException:
+            await response.__aexit__(None, None, None)
+            raise
+        return response, chunks, first
 
-            # TODO: hack to format audio correctly for device
-            outfile = tempfile.gettempdir() + "/" + "raw.dat"
-            ffmpeg.input(temp_file.name).output(
-                outfile, f="s16le", ar="16000", ac="1", loglevel="panic"
-            ).run()
 
-            return outfile
+async def close_response(opened):
+    response, _, _ = opened
+    await response.__aexit__(None, None, None)
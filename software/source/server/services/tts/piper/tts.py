@@ -1,45 +1,164 @@
-import ffmpeg
-import tempfile
+import json
 import os
+import queue
+import re
 import subprocess
+import threading
 import urllib.request
 import tarfile
 import platform
 
+from source.server.utils.logs import logger
+from source.utils import audio
+from source.server.utils.logs import setup_logging
+
+setup_logging()
+
+# How many Piper processes (each with the voice loaded) synthesize in parallel
+WORKERS = int(os.getenv("PIPER_WORKERS", 1))
+
+# Piper logs this after each line it has synthesized, with the exact length of
+# the audio (spdlog prints the shortest float that round-trips)
+DONE_LINE = re.compile(r"Real-time factor: .*audio=([0-9.eE+-]+) sec")
+# How long a single line can take before the worker is considered stuck
+SYNTHESIS_TIMEOUT = 30
+# Piper has written all the audio by the time it logs its length, so the rest
+# can only be in the pipe. If it doesn't come, the length was wrong
+DONE_TIMEOUT = 1
+# Piper's own pause after each sentence isn't in the length it logs, so it's
+# turned off and added here instead
+SENTENCE_SILENCE_SECONDS = 0.2
+
+
+class PiperWorker:
+    """
+    A long running `piper --output_raw` process. Text goes in over stdin, one line
+    per utterance, and raw PCM comes back on stdout as it's synthesized, so the
+    voice model is only loaded once.
+
+    Piper doesn't mark the end of an utterance in its output, so the "Real-time
+    factor" line it logs once the utterance's audio is all written tells how many
+    bytes belong to it, and exactly that many are read.
+    """
+
+    def __init__(self, command, sample_rate):
+        self.sample_rate = sample_rate
+        self.process = subprocess.Popen(
+            command + ["--sentence_silence", "0"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        # ("audio", bytes), ("done", byte count) or ("exit", None)
+        self.output = queue.Queue()
+        threading.Thread(target=self._read_audio, daemon=True).start()
+        threading.Thread(target=self._read_log, daemon=True).start()
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def synthesize(self, text):
+        """
+        Yields raw PCM at the voice's sample rate until the utterance is done.
+        Raises if its length doesn't add up, since the worker can't be trusted
+        with the next utterance then.
+        """
+        line = " ".join(text.split()) + "\n"
+        self.process.stdin.write(line.encode())
+        self.process.stdin.flush()
+
+        received = 0
+        expected = None
+        while expected is None or received < expected:
+            try:
+                kind, value = self.output.get(
+                    timeout=SYNTHESIS_TIMEOUT if expected is None else DONE_TIMEOUT
+                )
+            except queue.Empty:
+                if expected is not None:
+                    break  # Reported as a wrong length below
+                raise TimeoutError(f"Piper took too long to say {text!r}")
+
+            if kind == "audio":
+                received += len(value)
+                yield value
+            elif kind == "done":
+                expected = value
+            else:
+                raise RuntimeError("Piper exited")
+
+        if received != expected:
+            raise RuntimeError(
+                f"Piper sent {received} bytes of audio for {text!r}, but said {expected}"
+            )
+
+    def close(self):
+        self.process.kill()
+
+    def _read_audio(self):
+        while chunk := self.process.stdout.read(4096):
+            self.output.put(("audio", chunk))
+        self.output.put(("exit", None))
+
+    def _read_log(self):
+        for line in self.process.stderr:
+            match = DONE_LINE.search(line.decode(errors="replace"))
+            if match:
+                samples = round(float(match.group(1)) * self.sample_rate)
+                self.output.put(("done", samples * 2))
+
 
 class Tts:
     def __init__(self, config):
         self.piper_directory = ""
+        self.voice = os.getenv("PIPER_VOICE_NAME", "en_US-lessac-medium.onnx")
         self.install(config["service_directory"])
 
-    def tts(self, text):
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            output_file = temp_file.name
-            piper_dir = self.piper_directory
-            subprocess.run(
-                [
-                    os.path.join(piper_dir, "piper"),
-                    "--model",
-                    os.path.join(
-                        piper_dir,
-                        os.getenv("PIPER_VOICE_NAME", "en_US-lessac-medium.onnx"),
-                    ),
-                    "--output_file",
-                    output_file,
-                ],
-                input=text,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
+        model = os.path.join(self.piper_directory, self.voice)
+        with open(f"{model}.json") as f:
+            self.sample_rate = json.load(f)["audio"]["sample_rate"]
 
-            # TODO: hack to format audio correctly for device
-            outfile = tempfile.gettempdir() + "/" + "raw.dat"
-            ffmpeg.input(temp_file.name).output(
-                outfile, f="s16le", ar="16000", ac="1", loglevel="panic"
-            ).run()
+        self.command = [
+            os.path.join(self.piper_directory, "piper"),
+            "--model",
+            model,
+            "--output_raw",
+        ]
+        # How many utterances can be synthesized at once
+        self.pool_size = WORKERS
+        self.workers = queue.Queue()
+        for _ in range(WORKERS):
+            self.workers.put(PiperWorker(self.command, self.sample_rate))
 
-            return outfile
+    def stream(self, text):
+        """Yields the 16kHz mono s16le audio of `text` as Piper produces it."""
+        worker = self.workers.get()
+        if not worker.alive:
+            logger.warning("Piper worker died, starting a new one")
+            worker = PiperWorker(self.command, self.sample_rate)
+
+        resampler = audio.StreamResampler(self.sample_rate)
+        utterance = worker.synthesize(text)
+        finished = False
+        try:
+            for chunk in utterance:
+                yield resampler.feed(chunk)
+            finished = True
+            silence = round(SENTENCE_SILENCE_SECONDS * self.sample_rate) * 2
+            yield resampler.feed(bytes(silence)) + resampler.flush()
+        finally:
+            utterance.close()
+            if not finished:
+                # The rest of the utterance would end up in the next one, so the
+                # worker is only handed back once all of it has been read
+                worker.close()
+                worker = PiperWorker(self.command, self.sample_rate)
+            self.workers.put(worker)
+
+    def tts(self, text):
+        return b"".join(self.stream(text))
 
     def install(self, service_directory):
         PIPER_FOLDER_PATH = service_directory
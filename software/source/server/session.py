@@ -0,0 +1,240 @@
+import asyncio
+import os
+import queue
+import re
+import threading
+import uuid
+
+from platformdirs import user_data_dir
+
+from ..utils.accumulator import Accumulator
+from ..utils import audio_frames
+from .utils.journal import ConversationJournal
+from .utils.conversation_store import ConversationStore
+from .utils.outbound import OutboundChannel
+from .utils.logs import setup_logging
+from .utils.logs import logger
+
+setup_logging()
+
+conversations_dir = os.path.join(user_data_dir("01"), "conversations")
+
+# "sqlite" keeps every conversation in one database, "jsonl" keeps a journal file per session
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "sqlite")
+
+conversation_store = None
+# Conversations are opened in worker threads, this keeps it to one store
+conversation_store_lock = threading.Lock()
+
+
+def open_conversation(session_id):
+    """Reads the conversation from disk, so it's called in a worker thread."""
+    global conversation_store
+
+    os.makedirs(conversations_dir, exist_ok=True)
+    if CONVERSATION_STORE == "jsonl":
+        return ConversationJournal(
+            os.path.join(conversations_dir, f"{session_id}.jsonl")
+        )
+
+    with conversation_store_lock:
+        if conversation_store is None:
+            conversation_store = ConversationStore(
+                os.path.join(conversations_dir, "conversations.db")
+            )
+    return conversation_store.open(session_id)
+
+
+def close_conversation_store():
+    """Waits for the store's pending writes, when the server shuts down."""
+    global conversation_store
+
+    with conversation_store_lock:
+        if conversation_store is not None:
+            conversation_store.close()
+            conversation_store = None
+
+
+def sanitize_session_id(session_id):
+    """Device IDs end up in file names, so only keep the safe characters."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", session_id)[:64]
+
+
+class NotifyingQueue(asyncio.Queue):
+    """An asyncio.Queue that calls `notify` whenever an item is put in it."""
+
+    def __init__(self, notify):
+        super().__init__()
+        self._notify = notify
+
+    def _put(self, item):
+        super()._put(item)
+        self._notify()
+
+
+class ThreadSafeNotifyingQueue(queue.Queue):
+    """A queue.Queue that calls `notify` on `loop` whenever an item is put in it, from any thread."""
+
+    def __init__(self, loop, notify):
+        super().__init__()
+        self._loop = loop
+        self._notify = notify
+
+    def _put(self, item):
+        super()._put(item)
+        try:
+            self._loop.call_soon_threadsafe(self._notify)
+        except RuntimeError:
+            pass  # The loop is closed, nobody is listening anymore
+
+
+class Session:
+    """
+    Everything one connected device owns: its queues, its accumulator,
+    its conversation journal and its own interpreter instance.
+    """
+
+    def __init__(self, session_id, persistent=False):
+        self.id = session_id
+        # Sessions keyed by a device ID survive reconnects. Anonymous ones don't.
+        self.persistent = persistent
+
+        # Interpreter threads use this to hand messages back to the event loop
+        self.loop = asyncio.get_running_loop()
+
+        # Set whenever either of the incoming queues gets something
+        self.has_input = asyncio.Event()
+
+        # Queues
+        self.from_computer = ThreadSafeNotifyingQueue(
+            self.loop, self.has_input.set
+        )  # Just for computer messages from the device. Sync queue because interpreter.run is synchronous
+        self.from_user = NotifyingQueue(
+            self.has_input.set
+        )  # Just for user messages from the device.
+        self.to_device = OutboundChannel()  # For messages we send.
+
+        self.accumulator = Accumulator()
+        # How audio is framed for the device, until it asks for something else
+        self.audio_settings = audio_frames.RAW
+        # Transcribes the utterance the device is recording, if it can be streamed
+        self.transcriber = None
+        # Hands the last streamed recording's text to the listener once it's done
+        self.finishing_transcript = None
+        self.interpreter = None
+        # Done once the session is set up, or with the error that stopped it
+        self.ready = self.loop.create_future()
+        # Opened off the event loop, along with the interpreter
+        self.conversation = None
+
+        self.connections = 0
+        self.tasks = []
+
+    async def next_input(self):
+        """Waits for the next chunk from the user or the computer, whichever comes first."""
+        while True:
+            # Cleared before looking, so a put that lands in between still wakes us
+            self.has_input.clear()
+            if not self.from_user.empty():
+                return self.from_user.get_nowait()
+            try:
+                return self.from_computer.get_nowait()
+            except queue.Empty:
+                pass
+            await self.has_input.wait()
+
+    def start(self, *coroutines):
+        """
+        Runs the session's background coroutines until the session is closed,
+        returns their tasks.
+        """
+        self.tasks = [task for task in self.tasks if not task.done()]
+        tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+        self.tasks += tasks
+        return tasks
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+        if self.interpreter is not None:
+            try:
+                self.interpreter.computer.terminate()
+            except Exception as e:
+                logger.debug(f"Failed to terminate interpreter of {self.id}: {e}")
+
+        if self.conversation is not None:
+            self.conversation.close()
+
+
+class SessionRegistry:
+    """
+    Maps device IDs (or one-off IDs for anonymous websockets) to sessions.
+
+    `create_interpreter(session)` is called in a worker thread, since
+    configuring an interpreter starts a kernel and runs the skills. The
+    session's conversation is read from disk in that thread too.
+    `on_create` receives every new session so the server can start its tasks.
+    """
+
+    def __init__(self, create_interpreter, on_create):
+        self.sessions = {}
+        self.create_interpreter = create_interpreter
+        self.on_create = on_create
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    async def connect(self, device_id=None):
+        if device_id:
+            session_id = sanitize_session_id(device_id)
+        else:
+            session_id = uuid.uuid4().hex
+
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = Session(session_id, persistent=bool(device_id))
+            self.sessions[session_id] = session
+            try:
+                session.interpreter = await asyncio.to_thread(self._prepare, session)
+                self.on_create(session)
+            except BaseException as e:
+                self.sessions.pop(session_id, None)
+                session.close()
+                # Connections that were waiting for it fail too
+                if isinstance(e, asyncio.CancelledError):
+                    session.ready.cancel()
+                else:
+                    session.ready.set_exception(e)
+                    session.ready.exception()  # Nobody has to be waiting
+                raise
+            session.ready.set_result(None)
+            logger.info(f"Session {session_id} created.")
+        else:
+            # Shielded, so giving up on this connection doesn't cancel it for others
+            await asyncio.shield(session.ready)
+
+        session.connections += 1
+        session.to_device.connected = True
+        # A (re)connecting device asks for its audio settings again
+        session.audio_settings = audio_frames.RAW
+        return session
+
+    def _prepare(self, session):
+        session.conversation = open_conversation(session.id)
+        return self.create_interpreter(session)
+
+    def disconnect(self, session):
+        session.connections -= 1
+        session.to_device.connected = session.connections > 0
+        if session.connections <= 0 and not session.persistent:
+            self.sessions.pop(session.id, None)
+            session.close()
+            logger.info(f"Session {session.id} closed.")
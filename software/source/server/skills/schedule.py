@@ -28,6 +28,11 @@ def schedule(message="", start=None, interval=None) -> None:
     escaped_question = prefixed_message.replace('"', '\\"')
     json_data = f'{{\\"text\\": \\"{escaped_question}\\"}}'
 
+    # Make sure the reminder goes back to the device that asked for it
+    session_id = os.getenv("DEVICE_SESSION_ID")
+    if session_id:
+        json_data = f'{{\\"text\\": \\"{escaped_question}\\", \\"session_id\\": \\"{session_id}\\"}}'
+
     command = f"""bash -c 'if [ "$(cat "{session_file_path}")" == "{file_session_value}" ]; then /usr/bin/curl -X POST -H "Content-Type: application/json" -d "{json_data}" http://localhost:10001/; fi' """
 
     cron = CronTab(user=True)
@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from source.server.utils.async_stream import iterate_in_thread
+
+
+def test_closing_waits_for_the_generator_to_stop():
+    events = []
+
+    def count():
+        try:
+            for i in range(100):
+                time.sleep(0.01)
+                events.append(i)
+                yield i
+        finally:
+            events.append("closed")
+
+    async def take_one():
+        items = iterate_in_thread(count)
+        async for item in items:
+            break
+        await items.aclose()
+        return list(events)
+
+    # Nothing more is produced once it's closed
+    events_at_close = asyncio.run(take_one())
+    assert events_at_close[-1] == "closed"
+    time.sleep(0.05)
+    assert events == events_at_close
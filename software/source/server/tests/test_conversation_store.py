@@ -0,0 +1,84 @@
+import itertools
+
+from source.server.utils import conversation_store
+from source.server.utils.conversation_store import ConversationStore
+
+
+def user(content):
+    return {"role": "user", "type": "message", "content": content}
+
+
+def assistant(content):
+    return {"role": "assistant", "type": "message", "content": content}
+
+
+def flush(store):
+    """Waits for the writes queued so far."""
+    store._execute(lambda connection: None).result()
+
+
+def test_sync_rewrites_and_truncates_the_tail(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    conversation = store.open("device")
+
+    conversation.append(user("hi"))
+    # The interpreter rewrites its reply while it streams
+    conversation.sync([user("hi"), assistant("one")])
+    conversation.sync([user("hi"), assistant("one two"), assistant("three")])
+    conversation.sync([user("hi"), assistant("one two")])
+    flush(store)
+
+    assert conversation.messages == [user("hi"), assistant("one two")]
+    assert list(store.iter_messages("device")) == conversation.messages
+    store.close()
+
+
+def test_reopening_loads_the_latest_turns(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    conversation = store.open("device")
+    messages = []
+    for turn in range(5):
+        conversation.append(user(f"question {turn}"))
+        messages = conversation.messages + [assistant(f"answer {turn}")]
+        conversation.sync(messages)
+    flush(store)
+
+    reopened = store.open("device", history_turns=2)
+    assert reopened.messages == messages[-4:]
+
+    # And carries on after what it didn't load
+    reopened.append(user("question 5"))
+    reopened.sync(reopened.messages + [assistant("answer 5")])
+    flush(store)
+    assert list(store.iter_messages("device")) == messages + [
+        user("question 5"),
+        assistant("answer 5"),
+    ]
+    assert [session["id"] for session in store.sessions()] == ["device"]
+    store.close()
+
+
+def test_messages_can_be_searched_by_time_and_role(tmp_path, monkeypatch):
+    clock = itertools.count(100)
+    monkeypatch.setattr(conversation_store.time, "time", lambda: next(clock))
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    # Opening reads the clock once
+    conversation = store.open("device")
+    for turn in range(3):
+        conversation.append(user(f"question {turn}"))
+        conversation.sync(conversation.messages + [assistant(f"answer {turn}")])
+    flush(store)
+    # Written at 101 to 106, a message at a time
+    assert list(store.iter_messages("device", since=104, until=106)) == [
+        assistant("answer 1"),
+        user("question 2"),
+    ]
+    assert list(store.iter_messages("device", role="user")) == [
+        user(f"question {turn}") for turn in range(3)
+    ]
+    assert list(store.iter_messages("device", since=104, role="assistant")) == [
+        assistant("answer 1"),
+        assistant("answer 2"),
+    ]
+    assert list(store.iter_messages("someone else")) == []
+    store.close()
@@ -0,0 +1,26 @@
+from source.server.utils.journal import ConversationJournal
+
+
+def test_long_sessions_are_rarely_compacted(tmp_path):
+    path = str(tmp_path / "conversation.jsonl")
+    journal = ConversationJournal(path, compact_every=20)
+    rewrites = []
+    replace_file = journal._replace_file
+    journal._replace_file = lambda lines: rewrites.append(replace_file(lines))
+
+    messages = []
+    for turn in range(200):
+        message = {"role": "user", "type": "message", "content": str(turn)}
+        messages.append(message)
+        journal.append(message)
+        # The interpreter rewrites its reply while it streams
+        for reply in ["one", "one two", "one two three"]:
+            journal.sync(messages + [{"role": "assistant", "content": reply}])
+        messages = list(journal.messages)
+    journal.close()
+
+    # Each compaction at least halves the file, so they only get rarer
+    assert 0 < len(rewrites) <= 10
+    reopened = ConversationJournal(path)
+    assert reopened.messages == messages
+    reopened.close()
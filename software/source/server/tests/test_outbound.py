@@ -0,0 +1,47 @@
+import asyncio
+
+from source.server.utils.outbound import OutboundChannel
+
+
+def test_a_slow_device_gets_every_byte_of_audio():
+    chunks = [bytes([i]) * 100 for i in range(50)]
+
+    async def speak(channel):
+        await channel.put({"role": "assistant", "type": "audio", "start": True})
+        for chunk in chunks:
+            await channel.put(chunk)
+        await channel.put({"role": "assistant", "type": "audio", "end": True})
+
+    async def listen(channel):
+        received = []
+        while True:
+            message = await channel.get()
+            if isinstance(message, dict):
+                if "end" in message:
+                    return received
+                continue
+            assert channel._audio_bytes <= channel.max_audio_bytes
+            received.append(message)
+            await asyncio.sleep(0.001)
+
+    async def talk():
+        channel = OutboundChannel(max_audio_bytes=300)
+        channel.connected = True
+        _, received = await asyncio.gather(speak(channel), listen(channel))
+        return received
+
+    assert asyncio.run(talk()) == chunks
+
+
+def test_audio_is_dropped_when_nobody_listens():
+    async def talk():
+        channel = OutboundChannel(max_audio_bytes=300)
+        channel.connected = True
+        await channel.put(b"x" * 200)
+        channel.connected = False
+        # Doesn't wait for space nobody would make
+        await channel.put(b"y" * 1000)
+        await channel.put({"role": "assistant", "type": "message", "content": "hi"})
+        return channel.qsize()
+
+    assert asyncio.run(talk()) == 1
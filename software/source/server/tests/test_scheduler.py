@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+
+from source.server.utils.scheduler import FairScheduler
+
+
+def test_sessions_take_turns_and_urgent_calls_go_first():
+    order = []
+
+    async def call(name):
+        order.append(name)
+        await asyncio.sleep(0.01)
+
+    async def schedule():
+        scheduler = FairScheduler("test", 1)
+        calls = [
+            scheduler.run("busy", call, "busy 1"),
+            scheduler.run("busy", call, "busy 2"),
+            scheduler.run("busy", call, "busy 3"),
+            scheduler.run("other", call, "other 1"),
+            scheduler.run("late", call, "late 1", urgent=True),
+        ]
+        tasks = [asyncio.create_task(c) for c in calls]
+        await asyncio.sleep(0)
+        assert scheduler.status()["queued"] == 4
+        await asyncio.gather(*tasks)
+        assert scheduler.status() == {
+            "workers": 1,
+            "running": 0,
+            "queued": 0,
+            "sessions": {},
+        }
+
+    asyncio.run(schedule())
+    assert order == ["busy 1", "late 1", "busy 2", "other 1", "busy 3"]
+
+
+def test_a_cancelled_call_gives_up_its_place():
+    async def schedule():
+        scheduler = FairScheduler("test", 1)
+        first = asyncio.create_task(scheduler.run("a", asyncio.sleep, 0.01))
+        waiting = asyncio.create_task(scheduler.run("b", asyncio.sleep, 0))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await first
+        assert scheduler.status()["running"] == 0
+        # Sync calls run on the scheduler's threads
+        assert await scheduler.run("c", sum, [1, 2]) == 3
+
+    asyncio.run(schedule())
+
+
+def test_a_service_with_one_worker_only_has_callers_wait_in_line():
+    order = []
+    busy = threading.Lock()
+
+    class Service:
+        pool_size = 1
+
+        def tts(self, name):
+            # Its one worker, which nobody should have to wait for
+            assert busy.acquire(blocking=False)
+            order.append(name)
+            time.sleep(0.01)
+            busy.release()
+
+    service = Service()
+
+    async def schedule():
+        scheduler = FairScheduler("test", 4)
+        scheduler.limit(service.pool_size)
+        calls = [
+            scheduler.run("busy", service.tts, "busy 1"),
+            scheduler.run("busy", service.tts, "busy 2"),
+            scheduler.run("busy", service.tts, "busy 3"),
+            scheduler.run("other", service.tts, "other 1"),
+            scheduler.run("late", service.tts, "late 1", urgent=True),
+        ]
+        tasks = [asyncio.create_task(c) for c in calls]
+        await asyncio.sleep(0)
+        assert scheduler.status()["running"] == 1
+        assert scheduler.status()["queued"] == 4
+        await asyncio.gather(*tasks)
+
+    asyncio.run(schedule())
+    assert order == ["busy 1", "late 1", "busy 2", "other 1", "busy 3"]
@@ -0,0 +1,35 @@
+from source.server.utils.sentences import SentenceSegmenter
+
+
+def segment(chunks):
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for chunk in chunks:
+        sentences += segmenter.feed(chunk)
+    return sentences + segmenter.flush()
+
+
+def test_emits_each_sentence_once_as_soon_as_confirmed():
+    segmenter = SentenceSegmenter()
+    assert segmenter.feed("Let me check") == []
+    assert segmenter.feed(" on that.") == []
+    assert segmenter.feed(" It") == ["Let me check on that."]
+    assert segmenter.feed(" works! Done") == ["It works!"]
+    assert segmenter.flush() == ["Done"]
+    assert segmenter.flush() == []
+
+
+def test_same_result_token_by_token():
+    text = 'He said "hi." Then he left? Yes... And then, e.g. Dr. J. Smith paid $3.5 for main.py.'
+    expected = [
+        'He said "hi."',
+        "Then he left?",
+        "Yes...",
+        "And then, e.g. Dr. J. Smith paid $3.5 for main.py.",
+    ]
+    assert segment([text]) == expected
+    assert segment(list(text)) == expected
+
+
+def test_ellipsis_followed_by_lowercase_continues_the_sentence():
+    assert segment(["Well… maybe not. Ok"]) == ["Well… maybe not.", "Ok"]
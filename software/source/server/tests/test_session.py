@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+from source.server import session as session_module
+from source.server.session import SessionRegistry
+
+
+def test_connections_waiting_for_a_failed_session_fail_too(monkeypatch):
+    monkeypatch.setattr(session_module, "open_conversation", lambda session_id: None)
+    preparing = threading.Event()
+
+    def create_interpreter(session):
+        preparing.wait(1)
+        raise RuntimeError("No kernel")
+
+    async def connect_twice():
+        registry = SessionRegistry(create_interpreter, lambda session: None)
+        first = asyncio.create_task(registry.connect("device"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(registry.connect("device"))
+        await asyncio.sleep(0)
+        preparing.set()
+        results = await asyncio.wait_for(
+            asyncio.gather(first, second, return_exceptions=True), 1
+        )
+        return registry, results
+
+    registry, results = asyncio.run(connect_twice())
+    assert [str(result) for result in results] == ["No kernel", "No kernel"]
+    assert "device" not in registry
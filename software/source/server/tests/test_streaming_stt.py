@@ -0,0 +1,59 @@
+import asyncio
+import struct
+
+import numpy as np
+
+from source.server.utils import streaming_stt
+from source.utils import audio
+
+
+def wav_header(tag, bits=16):
+    fmt = struct.pack("<HHIIHH", tag, 1, 16000, 16000 * bits // 8, bits // 8, bits)
+    return (
+        b"RIFF"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack("<I", len(fmt))
+        + fmt
+        + b"data"
+        + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+async def no_transcription(pcm):
+    raise AssertionError("Nothing should be transcribed")
+
+
+def test_unsupported_audio_is_handed_back_whole():
+    transcriber = streaming_stt.StreamingTranscriber(no_transcription)
+    # MP3 in a WAV
+    pieces = [wav_header(0x55), bytes(1500), bytes(1500), bytes(1500)]
+
+    fed = b""
+    try:
+        for piece in pieces:
+            fed += piece
+            transcriber.feed(piece)
+    except audio.UnsupportedAudio:
+        pass
+    else:
+        raise AssertionError("The audio should have been refused")
+
+    assert not transcriber.streaming
+    assert transcriber.unconverted == fed
+
+
+def test_noise_floor_only_remembers_the_latest_audio():
+    async def listen():
+        transcriber = streaming_stt.StreamingTranscriber(no_transcription)
+        hiss = np.random.default_rng(0).normal(size=16000) * 30
+        for _ in range(int(streaming_stt.HISTORY_SECONDS) + 10):
+            transcriber.feed(hiss.astype("<i2").tobytes())
+        return transcriber
+
+    transcriber = asyncio.run(listen())
+    assert len(transcriber.history) == transcriber.history.maxlen
+    assert transcriber.history.maxlen * streaming_stt.FRAME == (
+        streaming_stt.HISTORY_SECONDS * audio.SAMPLE_RATE
+    )
@@ -0,0 +1,24 @@
+from source.server.utils.tts_cache import TtsCache
+
+
+def test_hits_survive_restarts_and_depend_on_the_voice(tmp_path):
+    cache = TtsCache(tmp_path, "piper", "lessac")
+    assert cache.get("One moment.") is None
+    cache.put("One moment.", b"\x01\x02")
+    assert cache.get("  One   moment. ") == b"\x01\x02"
+
+    restarted = TtsCache(tmp_path, "piper", "lessac")
+    assert restarted.get("One moment.") == b"\x01\x02"
+    assert TtsCache(tmp_path, "piper", "amy").get("One moment.") is None
+
+
+def test_least_recently_used_audio_is_evicted(tmp_path):
+    cache = TtsCache(tmp_path, "piper", memory_bytes=4, disk_bytes=4)
+    cache.put("a", b"aa")
+    cache.put("b", b"bb")
+    cache.get("a")
+    cache.put("c", b"cc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aa"
+    assert cache.get("c") == b"cc"
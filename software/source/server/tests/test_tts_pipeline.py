@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from source.server.utils.tts_pipeline import TtsPipeline
+
+
+def test_sends_in_order_while_synthesizing_ahead():
+    started = []
+    sent = []
+
+    def synthesize(sentence, urgent):
+        started.append(sentence)
+        assert urgent == (sentence == "one")
+        # Later sentences finish first, they still have to wait their turn
+        time.sleep(0.05 if sentence == "one" else 0.01)
+        yield sentence.encode()
+        yield b"."
+
+    async def send(audio):
+        sent.append(b"".join([chunk async for chunk in audio]))
+
+    async def speak():
+        pipeline = TtsPipeline(synthesize, send, lookahead=2)
+        for sentence in ["one", "two", "three"]:
+            await pipeline.say(sentence)
+        # All three are synthesizing before the first is sent
+        await asyncio.sleep(0.03)
+        assert sorted(started) == ["one", "three", "two"]
+        assert sent == []
+        await pipeline.close()
+
+    asyncio.run(speak())
+    assert sent == [b"one.", b"two.", b"three."]
+
+
+def test_a_failed_sentence_is_skipped():
+    sent = []
+
+    def synthesize(sentence, urgent):
+        if sentence == "bad":
+            raise RuntimeError("no voice")
+        yield sentence.encode()
+
+    async def send(audio):
+        sent.append(b"".join([chunk async for chunk in audio]))
+
+    async def speak():
+        pipeline = TtsPipeline(synthesize, send)
+        for sentence in ["good", "bad", "fine"]:
+            await pipeline.say(sentence)
+        await pipeline.close()
+
+    asyncio.run(speak())
+    assert sent == [b"good", b"fine"]
@@ -0,0 +1,37 @@
+import numpy as np
+
+from source.server.utils import vad
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * 300 * t) * 5000).astype("<i2")
+
+
+def hiss(seconds):
+    return (
+        np.random.default_rng(0).normal(size=int(SAMPLE_RATE * seconds)) * 30
+    ).astype("<i2")
+
+
+def test_trims_silence_around_speech():
+    pcm = np.concatenate([hiss(1), tone(1), hiss(0.3), tone(1), hiss(2)]).tobytes()
+    speech, seconds = vad.trim(pcm)
+
+    assert abs(seconds - 2) < 0.1
+    # The speech with a little padding on each side
+    assert 2.3 < len(speech) / 2 / SAMPLE_RATE < 2.8
+
+
+def test_silence_and_clicks_are_dropped():
+    assert vad.trim(hiss(3).tobytes()) == (b"", 0.0)
+    click = np.concatenate([hiss(1), tone(0.05), hiss(1)]).tobytes()
+    assert vad.trim(click)[1] == 0.0
+
+
+def test_all_speech_is_kept():
+    pcm = tone(2).tobytes()
+    speech, seconds = vad.trim(pcm)
+    assert len(speech) == len(pcm)
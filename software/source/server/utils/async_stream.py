@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+_DONE = object()
+
+
+async def iterate_in_thread(generator_function, *args, **kwargs):
+    """
+    Runs a synchronous generator in a worker thread and yields its items on the event loop.
+
+    Closing the async generator (or breaking out of it and calling `aclose()`) stops the
+    worker after the item it is currently producing, and closes the sync generator there.
+    It only returns once that's done, so whatever the generator was changing is left alone.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+
+    def hand_over(item, error=None):
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, (item, error))
+        except RuntimeError:
+            stop.set()  # The loop is closed, nobody is listening anymore
+
+    def produce():
+        try:
+            generator = generator_function(*args, **kwargs)
+            try:
+                for item in generator:
+                    hand_over(item)
+                    if stop.is_set():
+                        break
+            finally:
+                generator.close()
+        except BaseException as e:
+            hand_over(_DONE, e)
+        else:
+            hand_over(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = await items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        await asyncio.to_thread(thread.join)
@@ -0,0 +1,256 @@
+import contextlib
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from .logs import setup_logging
+from .logs import logger
+
+setup_logging()
+
+# How many of a session's most recent turns are loaded back into memory
+HISTORY_TURNS = int(os.getenv("CONVERSATION_HISTORY_TURNS", 50))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    last_active REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    turn_id INTEGER NOT NULL REFERENCES turns(id),
+    position INTEGER NOT NULL,
+    role TEXT,
+    type TEXT,
+    format TEXT,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_by_session ON turns(session_id, started_at);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_by_position ON messages(session_id, position);
+CREATE INDEX IF NOT EXISTS messages_by_time ON messages(session_id, created_at);
+CREATE INDEX IF NOT EXISTS messages_by_turn ON messages(turn_id);
+"""
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    return connection
+
+
+class ConversationStore:
+    """
+    Every session's conversation in one SQLite database, in WAL mode so reads
+    never wait for the writer.
+
+    All writes go through a single background thread with its own connection.
+    Queries open a short-lived connection in the caller's thread and stream rows,
+    so old conversations can be searched without loading them into memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._local = threading.local()
+        self._writer.submit(self._setup).result()
+
+    def _setup(self):
+        self._local.connection = _connect(self.path)
+        self._local.connection.executescript(SCHEMA)
+        self._local.connection.commit()
+
+    def _execute(self, statements):
+        """Runs `statements` (a function of a connection) in one transaction on the writer."""
+
+        def run():
+            connection = self._local.connection
+            try:
+                with connection:
+                    return statements(connection)
+            except Exception:
+                # Nobody waits for most writes, so this is the only trace of a failure
+                logger.error(
+                    f"Failed to write to {self.path}:\n{traceback.format_exc()}"
+                )
+
+        return self._writer.submit(run)
+
+    def open(self, session_id, history_turns=HISTORY_TURNS):
+        return StoredConversation(self, session_id, history_turns)
+
+    @contextlib.contextmanager
+    def _read(self):
+        connection = sqlite3.connect(self.path)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def sessions(self):
+        """Yields (id, created_at, last_active) of every session, most recently active first."""
+        with self._read() as connection:
+            yield from connection.execute(
+                "SELECT id, created_at, last_active FROM sessions ORDER BY last_active DESC"
+            )
+
+    def recent_turns(self, session_id, limit=HISTORY_TURNS):
+        """Returns the messages of the last `limit` turns of a session, oldest first."""
+        with self._read() as connection:
+            rows = connection.execute(
+                """
+                SELECT messages.content FROM messages
+                WHERE messages.turn_id IN (
+                    SELECT id FROM turns WHERE session_id = ?
+                    ORDER BY started_at DESC, id DESC LIMIT ?
+                )
+                ORDER BY messages.position
+                """,
+                (session_id, limit),
+            )
+            return [json.loads(row["content"]) for row in rows]
+
+    def iter_messages(self, session_id, since=None, until=None, role=None):
+        """Yields a session's messages oldest first, optionally within a time range or for one role."""
+        query = "SELECT content FROM messages WHERE session_id = ?"
+        parameters = [session_id]
+        if since is not None:
+            query += " AND created_at >= ?"
+            parameters.append(since)
+        if until is not None:
+            query += " AND created_at < ?"
+            parameters.append(until)
+        if role is not None:
+            query += " AND role = ?"
+            parameters.append(role)
+        query += " ORDER BY position"
+
+        with self._read() as connection:
+            for row in connection.execute(query, parameters):
+                yield json.loads(row["content"])
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+
+
+class StoredConversation:
+    """
+    One session's conversation. Same interface as ConversationJournal: recent turns
+    are kept in `messages`, and changes are written to the store in the background.
+
+    `append` starts a new turn, `sync` adds to (or rewrites the end of) the current one.
+    """
+
+    def __init__(self, store, session_id, history_turns=HISTORY_TURNS):
+        self.store = store
+        self.session_id = session_id
+        self.messages = store.recent_turns(session_id, history_turns)
+        # Only touched by the store's writer thread
+        self._turn_id = None
+
+        def open_session(connection):
+            now = time.time()
+            connection.execute(
+                "INSERT INTO sessions (id, created_at, last_active) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET last_active = excluded.last_active",
+                (session_id, now, now),
+            )
+            row = connection.execute(
+                "SELECT COUNT(*) AS count, MAX(turn_id) AS turn FROM messages WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            self._turn_id = row["turn"]
+            return row["count"]
+
+        count = store._execute(open_session).result() or 0
+        # Position (in the whole session) of the first message we hold in memory
+        self._offset = count - len(self.messages)
+
+    def append(self, message):
+        message = copy.deepcopy(message)
+        position = self._offset + len(self.messages)
+        self.messages.append(message)
+
+        def insert(connection):
+            now = time.time()
+            self._turn_id = self._start_turn(connection, now)
+            self._insert(connection, position, [message], now)
+
+        self.store._execute(insert)
+
+    def sync(self, messages):
+        """Makes the conversation match `messages`, writing only what changed."""
+        common = 0
+        for old, new in zip(self.messages, messages):
+            if old != new:
+                break
+            common += 1
+
+        if common == len(self.messages) == len(messages):
+            return
+
+        tail = copy.deepcopy(messages[common:])
+        del self.messages[common:]
+        self.messages.extend(tail)
+        position = self._offset + common
+
+        def replace_tail(connection):
+            now = time.time()
+            if self._turn_id is None:
+                self._turn_id = self._start_turn(connection, now)
+            connection.execute(
+                "DELETE FROM messages WHERE session_id = ? AND position >= ?",
+                (self.session_id, position),
+            )
+            self._insert(connection, position, tail, now)
+
+        self.store._execute(replace_tail)
+
+    def _start_turn(self, connection, now):
+        return connection.execute(
+            "INSERT INTO turns (session_id, started_at) VALUES (?, ?)",
+            (self.session_id, now),
+        ).lastrowid
+
+    def _insert(self, connection, position, messages, now):
+        connection.executemany(
+            "INSERT INTO messages (session_id, turn_id, position, role, type, format, content, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    self.session_id,
+                    self._turn_id,
+                    position + i,
+                    message.get("role"),
+                    message.get("type"),
+                    message.get("format"),
+                    json.dumps(message),
+                    now,
+                )
+                for i, message in enumerate(messages)
+            ],
+        )
+        connection.execute(
+            "UPDATE sessions SET last_active = ? WHERE id = ?",
+            (now, self.session_id),
+        )
+
+    def close(self):
+        # The store is shared between sessions, and closed with the server
+        pass
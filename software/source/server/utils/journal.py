@@ -0,0 +1,111 @@
+import copy
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .logs import setup_logging
+from .logs import logger
+
+setup_logging()
+
+# Rewrite the journal as a plain snapshot once it has at least this many lines,
+# and more than twice as many as there are messages. Compacting only when most of
+# the file is garbage keeps it rare, however long the history gets
+COMPACT_EVERY = int(os.getenv("CONVERSATION_COMPACT_EVERY", 200))
+
+
+class ConversationJournal:
+    """
+    A conversation kept in memory and persisted as an append-only JSONL file.
+
+    Every line is either a message, or `{"truncate": n}` when the history was
+    rewritten from message `n` on (the interpreter edits its last message while
+    streaming). Once most lines are obsolete, the file is compacted into a snapshot.
+
+    The file is only read when the journal is opened. Writes happen in order on a
+    single background thread, so callers on the event loop never touch the disk.
+    """
+
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self.messages = []
+        self._lines = 0
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Most likely a line cut short by a crash, the rest is still good
+                    logger.info(f"Skipping a broken line in {self.path}")
+                    continue
+                if "truncate" in entry:
+                    del self.messages[entry["truncate"] :]
+                else:
+                    self.messages.append(entry)
+                self._lines += 1
+
+    def append(self, message):
+        self.messages.append(copy.deepcopy(message))
+        self._write([message])
+
+    def sync(self, messages):
+        """Makes the journal match `messages`, writing only what changed."""
+        common = 0
+        for old, new in zip(self.messages, messages):
+            if old != new:
+                break
+            common += 1
+
+        if common == len(self.messages) == len(messages):
+            return
+
+        tail = copy.deepcopy(messages[common:])
+        truncate = common < len(self.messages)
+        del self.messages[common:]
+        self.messages.extend(tail)
+        self._write(tail, truncate=common if truncate else None)
+
+    def _write(self, messages, truncate=None):
+        lines = []
+        if truncate is not None:
+            lines.append(json.dumps({"truncate": truncate}))
+        lines.extend(json.dumps(message) for message in messages)
+        self._lines += len(lines)
+
+        if self._lines >= self.compact_every and self._lines > 2 * len(self.messages):
+            # Snapshot on the caller's side, since self.messages keeps changing
+            snapshot = [json.dumps(message) for message in self.messages]
+            self._lines = len(snapshot)
+            self._writer.submit(self._replace_file, snapshot)
+        else:
+            self._writer.submit(self._append_to_file, lines)
+
+    def _append_to_file(self, lines):
+        try:
+            with open(self.path, "a") as file:
+                file.write("".join(line + "\n" for line in lines))
+        except OSError as e:
+            logger.error(f"Failed to write to {self.path}: {e}")
+
+    def _replace_file(self, lines):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as file:
+                file.write("".join(line + "\n" for line in lines))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to compact {self.path}: {e}")
+
+    def close(self):
+        self._writer.shutdown(wait=True)
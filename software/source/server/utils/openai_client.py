@@ -0,0 +1,91 @@
+"""
+The OpenAI client the STT and TTS services share, so they share one pool of
+kept-alive connections. Point OPENAI_BASE_URL at a local stand-in to test
+without the real API.
+"""
+
+import asyncio
+import os
+
+import httpx
+from openai import AsyncOpenAI
+
+# Seconds a request (or the wait for the next streamed bytes) can take
+TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+# Retries of failed requests, with backoff, done by the client itself
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+# A second, identical request is sent if the first hasn't answered after this
+# many seconds, and whichever answers first is used. 0 turns it off
+HEDGE_AFTER = float(os.getenv("OPENAI_HEDGE_AFTER", 0))
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        timeout = httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT)
+        _client = AsyncOpenAI(
+            timeout=timeout,
+            max_retries=MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                ),
+            ),
+        )
+    return _client
+
+
+async def hedged(request, discard=None, hedge_after=None):
+    """
+    Awaits `request()`, and if it takes longer than `hedge_after` seconds, races
+    it against a second `request()`. Returns the first to succeed, and cancels
+    the other. A result that lost the race is passed to `discard`, so whatever it
+    holds open can be closed.
+    """
+    hedge_after = HEDGE_AFTER if hedge_after is None else hedge_after
+    first = asyncio.ensure_future(request())
+    if hedge_after <= 0:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done:
+        return first.result()
+
+    pending = {first, asyncio.ensure_future(request())}
+    winner = None
+    error = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task
+                elif discard:
+                    await discard(task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+            if discard:
+                task.add_done_callback(_discard_later(discard))
+
+    if winner is None:
+        raise error
+    return winner.result()
+
+
+def _discard_later(discard):
+    def callback(task):
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(discard(task.result()))
+
+    return callback
@@ -0,0 +1,118 @@
+import asyncio
+import collections
+import os
+
+from .logs import setup_logging
+from .logs import logger
+
+setup_logging()
+
+# Control and text messages waiting for the device before producers have to wait
+MAX_MESSAGES = int(os.getenv("OUTBOUND_MAX_MESSAGES", 1000))
+# Audio waiting for the device before producers have to wait (~30s of 16kHz PCM)
+MAX_AUDIO_BYTES = int(os.getenv("OUTBOUND_MAX_AUDIO_BYTES", 1024 * 1024))
+
+
+def is_audio(message):
+    return isinstance(message, (bytes, bytearray, memoryview)) or (
+        isinstance(message, dict) and message.get("type") == "audio"
+    )
+
+
+class OutboundChannel:
+    """
+    Bounded queue of messages for one device, in two priority classes.
+
+    Control and text messages always go out before audio. Audio is the audio
+    messages' flags plus their bytes. Each class keeps its own order.
+
+    While a device is connected, producers wait for space, so a slow link slows
+    speech down instead of cutting pieces out of it. When nobody is connected,
+    audio is dropped (including what was waiting), and the oldest control
+    messages make room for new ones.
+    """
+
+    def __init__(self, max_messages=MAX_MESSAGES, max_audio_bytes=MAX_AUDIO_BYTES):
+        self.max_messages = max_messages
+        self.max_audio_bytes = max_audio_bytes
+        self._control = collections.deque()
+        self._audio = collections.deque()
+        self._audio_bytes = 0
+        self._connected = False
+        self._changed = asyncio.Event()
+
+    @property
+    def connected(self):
+        return self._connected
+
+    @connected.setter
+    def connected(self, connected):
+        self._connected = connected
+        if not connected:
+            self._drop_audio()
+        self._changed.set()
+
+    def qsize(self):
+        return len(self._control) + len(self._audio)
+
+    def empty(self):
+        return not self._control and not self._audio
+
+    async def _wait_for(self, predicate):
+        while not predicate():
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def put(self, message):
+        if not is_audio(message):
+            await self._wait_for(
+                lambda: len(self._control) < self.max_messages or not self._connected
+            )
+        elif not isinstance(message, dict):
+            await self._wait_for(
+                lambda: self._audio_bytes < self.max_audio_bytes or not self._connected
+            )
+        self.put_nowait(message)
+
+    def put_nowait(self, message):
+        """
+        Never waits, so audio can go over its limit. Also safe to hand to
+        `loop.call_soon_threadsafe`.
+        """
+        if is_audio(message):
+            if not self._connected:
+                return  # Nobody is listening
+            self._audio.append(message)
+            if not isinstance(message, dict):
+                self._audio_bytes += len(message)
+        else:
+            if len(self._control) >= self.max_messages:
+                self._control.popleft()
+                logger.debug("Outbound queue is full, dropped the oldest message.")
+            self._control.append(message)
+        self._changed.set()
+
+    async def get(self):
+        await self._wait_for(lambda: self._control or self._audio)
+        if self._control:
+            message = self._control.popleft()
+        else:
+            message = self._audio.popleft()
+            if not isinstance(message, dict):
+                self._audio_bytes -= len(message)
+        self._changed.set()
+        return message
+
+    def requeue(self, message):
+        """Puts a message that failed to send back in front of its class, so order is kept."""
+        if is_audio(message):
+            self._audio.appendleft(message)
+            if not isinstance(message, dict):
+                self._audio_bytes += len(message)
+        else:
+            self._control.appendleft(message)
+        self._changed.set()
+
+    def _drop_audio(self):
+        self._audio.clear()
+        self._audio_bytes = 0
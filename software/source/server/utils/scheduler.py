@@ -0,0 +1,196 @@
+"""
+Bounded STT and TTS workers, shared fairly between sessions.
+
+Every STT or TTS call waits for a turn on its service's scheduler, which
+never runs more calls at once than the service has workers for. Sessions
+take turns round-robin, so one long dictation can't hold up everybody else,
+and urgent calls (the first sentence of a reply, which someone is waiting to
+hear) go before the rest.
+"""
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import multiprocessing
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from importlib import import_module
+
+from .async_stream import iterate_in_thread
+from .logs import setup_logging
+from .logs import logger
+
+setup_logging()
+
+# How many calls each service runs at once
+STT_WORKERS = int(os.getenv("STT_WORKERS", os.cpu_count() or 1))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", os.cpu_count() or 1))
+# "thread", or "process" to run sync services in worker processes, each with
+# its own copy of the service. Async services always run on the event loop
+EXECUTOR = os.getenv("SERVICE_EXECUTOR", "thread").lower()
+
+
+class FairScheduler:
+    """
+    Lets at most `workers` calls run at once. The rest wait in one queue per
+    session, and a freed worker goes to the next session in turn, urgent calls
+    first.
+
+    Sync functions run on the scheduler's own thread pool, async ones on the loop.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix=name)
+        self.running = 0
+        # session id -> deque of (urgent, future), in the order sessions get a turn
+        self._waiting = OrderedDict()
+
+    def limit(self, workers):
+        """
+        Runs at most `workers` calls at once, for a service with only that many
+        workers of its own. Calls then only ever wait here, where it's fair.
+        """
+        self.workers = max(1, min(self.workers, workers))
+
+    async def run(self, session_id, function, *args, urgent=False):
+        async with self.turn(session_id, urgent):
+            if inspect.iscoroutinefunction(function):
+                return await function(*args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(function, *args)
+            )
+
+    async def stream(self, session_id, generator_function, *args, urgent=False):
+        """Yields from a sync or async generator, holding one turn until it's done."""
+        async with self.turn(session_id, urgent):
+            if inspect.isasyncgenfunction(generator_function):
+                items = generator_function(*args)
+            else:
+                items = iterate_in_thread(generator_function, *args)
+            try:
+                async for item in items:
+                    yield item
+            finally:
+                await items.aclose()
+
+    @contextlib.asynccontextmanager
+    async def turn(self, session_id, urgent=False):
+        if self.running < self.workers and not self._waiting:
+            self.running += 1
+        else:
+            turn = asyncio.get_running_loop().create_future()
+            self._waiting.setdefault(session_id, deque()).append((urgent, turn))
+            try:
+                await turn
+            except asyncio.CancelledError:
+                if turn.done() and not turn.cancelled():
+                    # The turn was handed over just as the wait was cancelled
+                    self._release()
+                else:
+                    self._forget(session_id, turn)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def status(self):
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": sum(len(calls) for calls in self._waiting.values()),
+            "sessions": {
+                session_id: len(calls) for session_id, calls in self._waiting.items()
+            },
+        }
+
+    def _release(self):
+        """Hands the finished call's worker over to the next one, if any."""
+        turn = self._next()
+        if turn is None:
+            self.running -= 1
+        else:
+            turn.set_result(None)
+
+    def _next(self):
+        for want_urgent in (True, False):
+            for session_id, calls in self._waiting.items():
+                for call in calls:
+                    urgent, turn = call
+                    if turn.done():
+                        continue  # Cancelled, and about to be forgotten
+                    if urgent or not want_urgent:
+                        calls.remove(call)
+                        # This session goes to the back of the line
+                        del self._waiting[session_id]
+                        if calls:
+                            self._waiting[session_id] = calls
+                        return turn
+        return None
+
+    def _forget(self, session_id, turn):
+        calls = self._waiting.get(session_id)
+        if calls is None:
+            return
+        for call in calls:
+            if call[1] is turn:
+                calls.remove(call)
+                break
+        if not calls:
+            del self._waiting[session_id]
+
+
+class ProcessService:
+    """
+    A sync STT or TTS service run in `workers` worker processes, each with its
+    own instance, so CPU-bound local models use every core.
+    """
+
+    def __init__(self, module_name, class_name, config, workers):
+        self.pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_service,
+            initargs=(module_name, class_name, config),
+        )
+        # The first worker installs whatever the service needs, before any others start
+        self.pool.submit(_loaded).result()
+        logger.info(f"{class_name} runs in up to {workers} worker processes")
+
+    def method(self, name):
+        async def call(*args):
+            # Memoryviews can't be sent to another process
+            args = [bytes(a) if isinstance(a, memoryview) else a for a in args]
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, _call, name, args)
+
+        return call
+
+    def attribute(self, name, default=None):
+        """An attribute of the service, as a worker process has it."""
+        return self.pool.submit(_attribute, name, default).result()
+
+
+_service = None
+
+
+def _load_service(module_name, class_name, config):
+    global _service
+    _service = getattr(import_module(module_name), class_name)(config)
+
+
+def _loaded():
+    return _service is not None
+
+
+def _attribute(name, default):
+    return getattr(_service, name, default)
+
+
+def _call(name, args):
+    return getattr(_service, name)(*args)
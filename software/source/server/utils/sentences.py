@@ -0,0 +1,105 @@
+TERMINATORS = ".!?…"
+# Quotes and brackets that can close a sentence after its terminator
+CLOSERS = "\"')]}”’»"
+# Words that end in a period without ending the sentence. Ones that often do end
+# sentences ("etc.", "inc.") are left out on purpose.
+ABBREVIATIONS = {
+    "mr",
+    "mrs",
+    "ms",
+    "dr",
+    "prof",
+    "sr",
+    "jr",
+    "st",
+    "vs",
+    "e.g",
+    "i.e",
+    "cf",
+    "approx",
+    "fig",
+}
+
+
+class SentenceSegmenter:
+    """
+    Splits streamed text into sentences, emitting each one exactly once, as soon as
+    the text after it confirms the boundary.
+
+    A sentence ends at ".", "!", "?" or an ellipsis (plus any closing quotes or
+    brackets) followed by whitespace, so "3.5" and "main.py" don't split. Periods
+    after common abbreviations ("e.g.", "Dr.") and initials ("J.") don't either, and
+    an ellipsis only ends a sentence if the next word is capitalized.
+
+    Only the text after the last emitted sentence is kept, and it's scanned once.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # Where scanning resumes in the buffer
+        self._scan = 0
+
+    def feed(self, text):
+        """Adds text, and returns the sentences it completed."""
+        buffer = self._buffer + text
+        sentences = []
+        start = 0
+        i = self._scan
+
+        while i < len(buffer):
+            if buffer[i] not in TERMINATORS:
+                i += 1
+                continue
+
+            end = i + 1
+            while end < len(buffer) and buffer[end] in TERMINATORS:
+                end += 1
+            while end < len(buffer) and buffer[end] in CLOSERS:
+                end += 1
+
+            boundary = self._is_boundary(buffer, start, i, end)
+            if boundary is None:
+                break  # Need more text to decide, look at this terminator again then
+            if boundary:
+                sentence = buffer[start:end].strip()
+                if sentence:
+                    sentences.append(sentence)
+                start = end
+            i = end
+
+        self._buffer = buffer[start:]
+        self._scan = i - start
+        return sentences
+
+    def flush(self):
+        """Returns whatever is left as the final sentence (if anything), and resets."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        self._scan = 0
+        return [rest] if rest else []
+
+    def _is_boundary(self, buffer, start, terminator, end):
+        """True or False, or None if it can't be told yet."""
+        if end >= len(buffer):
+            return None
+        if not buffer[end].isspace():
+            return False
+
+        marks = buffer[terminator:end].rstrip(CLOSERS)
+
+        if marks.startswith("…") or marks.startswith(".."):
+            # An ellipsis ends a sentence only if a new one visibly starts
+            following = buffer[end:].lstrip()
+            if not following:
+                return None
+            return not following[0].islower()
+
+        if marks == ".":
+            word = buffer[start:terminator].rsplit(None, 1)[-1:]
+            word = word[0].lstrip("\"'([{“‘«") if word else ""
+            if word.lower() in ABBREVIATIONS:
+                return False
+            if len(word) == 1 and word.isupper():
+                return False  # An initial, like "J. K. Rowling"
+
+        return True
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import traceback
+from collections import deque
+
+import numpy as np
+
+from . import vad
+from .logs import setup_logging
+from .logs import logger
+
+from ...utils import audio
+
+setup_logging()
+
+# Transcribe voice while it's being recorded, instead of all of it at the end
+STREAMING = os.getenv("STT_STREAMING", "True").lower() == "true"
+# Device audio formats that can be transcribed as they arrive
+STREAMABLE_FORMATS = ("bytes.raw", "bytes.wav")
+
+# A segment is cut at the first pause once it's this long, or wherever it's
+# quietest once it's the max
+MIN_SEGMENT_SECONDS = float(os.getenv("STT_SEGMENT_MIN_SECONDS", 3))
+MAX_SEGMENT_SECONDS = float(os.getenv("STT_SEGMENT_MAX_SECONDS", 20))
+PAUSE_SECONDS = float(os.getenv("STT_PAUSE_SECONDS", 0.4))
+# The noise floor is measured over this much of the latest audio
+HISTORY_SECONDS = 30
+
+FRAME = vad.FRAME
+
+
+class StreamingTranscriber:
+    """
+    Transcribes one utterance while it's still being recorded.
+
+    The audio is cut into segments at pauses, and each segment is transcribed
+    once, in the background, as soon as it's cut. That text doesn't change
+    anymore, so when the speaker stops only the audio after the last cut is left
+    to transcribe. `on_partial(text)` gets the text so far whenever it grows.
+
+    `transcribe(pcm)` is a coroutine that turns 16kHz mono s16le into text.
+    `flag` is the start flag of the recording, kept for whoever has to take it
+    over if it turns out it can't be streamed.
+    """
+
+    def __init__(self, transcribe, on_partial=None, flag=None):
+        self.transcribe = transcribe
+        self.on_partial = on_partial
+        self.flag = flag
+        self.converter = audio.StreamConverter()
+        # False once the audio turned out to be in a format we can't convert
+        self.streaming = True
+        # Everything fed so far, if it's not streaming
+        self.unconverted = b""
+
+        # Audio after the last cut, and the loudness of each of its frames
+        self.tail = bytearray()
+        self.levels = []
+        # Loudness of the latest frames, for the noise floor
+        self.history = deque(maxlen=int(HISTORY_SECONDS * audio.SAMPLE_RATE) // FRAME)
+        # How many frames at the end of the tail are quiet
+        self.pause = 0
+
+        self.segments = []
+        self.texts = []
+        self.speech_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def feed(self, data):
+        """
+        Raises `audio.UnsupportedAudio` if the audio can't be converted. That's
+        known from its header, so before any of it was transcribed, and all of
+        it is in `unconverted`.
+        """
+        try:
+            self.tail += self.converter.feed(data)
+        except audio.UnsupportedAudio:
+            self.streaming = False
+            self.unconverted = bytes(self.converter.pending)
+            raise
+
+        analyzed = len(self.levels)
+        count = len(self.tail) // (FRAME * 2) - analyzed
+        if count <= 0:
+            return
+        start = analyzed * FRAME * 2
+        levels = vad.frame_levels(self.tail[start : start + count * FRAME * 2])
+        levels = levels.tolist()
+        self.history.extend(levels)
+
+        threshold = vad.speech_level(self.history)
+        for level in levels:
+            self.levels.append(level)
+            self.pause = self.pause + 1 if level < threshold else 0
+            cut = self._find_cut()
+            if cut:
+                self._cut(cut)
+
+    async def finish(self):
+        """Transcribes what's left, and returns the whole utterance's text."""
+        self.tail += self.converter.flush()
+        self._cut()
+
+        logger.info(
+            f"Heard {self.speech_seconds:.1f}s of speech in {self.total_seconds:.1f}s of audio"
+        )
+        texts = await asyncio.gather(*self.segments, return_exceptions=True)
+        return " ".join(text for text in texts if isinstance(text, str) and text)
+
+    def _find_cut(self):
+        """How many frames of the tail to cut off now, if any."""
+        frames = len(self.levels)
+
+        if frames * FRAME >= MIN_SEGMENT_SECONDS * audio.SAMPLE_RATE and (
+            self.pause * FRAME >= PAUSE_SECONDS * audio.SAMPLE_RATE
+        ):
+            # In the middle of the pause
+            return frames - self.pause // 2
+
+        if frames * FRAME >= MAX_SEGMENT_SECONDS * audio.SAMPLE_RATE:
+            # At the quietest frame of the second half
+            half = frames // 2
+            return half + int(np.argmin(self.levels[half:]))
+
+        return 0
+
+    def _cut(self, frames=None):
+        """Transcribes the first `frames` frames of the tail, or all of it."""
+        if frames is None:
+            segment = bytes(self.tail)
+            self.tail.clear()
+            self.levels = []
+        else:
+            segment = bytes(self.tail[: frames * FRAME * 2])
+            del self.tail[: frames * FRAME * 2]
+            self.levels = self.levels[frames:]
+            self.pause = min(self.pause, len(self.levels))
+
+        # Only the speech is transcribed. Whisper makes things up when it's given
+        # only silence, so silent segments aren't at all
+        self.total_seconds += len(segment) / 2 / audio.SAMPLE_RATE
+        segment, seconds = vad.trim(segment)
+        self.speech_seconds += seconds
+        if not segment:
+            return
+
+        task = asyncio.create_task(self._transcribe(segment))
+        task.add_done_callback(self._report)
+        self.segments.append(task)
+
+    async def _transcribe(self, segment):
+        try:
+            text = await self.transcribe(bytes(segment))
+        except Exception:
+            logger.error(f"Failed to transcribe a segment:\n{traceback.format_exc()}")
+            return ""
+        return " ".join((text or "").split())
+
+    def _report(self, _):
+        """Passes on the text of the segments that are done, in order."""
+        texts = []
+        for task in self.segments:
+            if not task.done():
+                break
+            texts.append(task.result())
+
+        if len(texts) > len(self.texts):
+            self.texts = texts
+            if self.on_partial:
+                self.on_partial(" ".join(text for text in texts if text))
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from .logs import setup_logging
+from .logs import logger
+
+from ...utils import audio_frames
+
+setup_logging()
+
+# Size limits of the two tiers, 0 turns a tier off
+MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+# What's cached is the device-ready audio, so its format is part of the key
+FORMAT = f"s16le/{audio_frames.SAMPLE_RATE}/{audio_frames.CHANNELS}"
+
+
+def normalize(text):
+    """Sentences that only differ in spacing sound the same."""
+    return " ".join(text.split())
+
+
+class TtsCache:
+    """
+    Device-ready PCM of spoken sentences, keyed by the TTS service, its voice, the
+    normalized text and the audio format.
+
+    Recently used audio is kept in memory, and everything is kept on disk under
+    `directory`, both least-recently-used first out once over their size limit.
+    Used from the TTS worker threads. The bookkeeping is behind a lock, the
+    files are read and written outside it.
+    """
+
+    def __init__(
+        self,
+        directory,
+        service,
+        voice="",
+        memory_bytes=MEMORY_BYTES,
+        disk_bytes=DISK_BYTES,
+    ):
+        self.directory = directory
+        self.service = service
+        self.voice = voice or ""
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # key -> size of what's on disk, oldest used first
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        # Keys being written to disk right now
+        self._storing = set()
+
+        if self.disk_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    def key(self, text):
+        parts = [self.service, self.voice, normalize(text), FORMAT]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, text):
+        """The cached audio of `text`, or None."""
+        key = self.key(text)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+
+        if on_disk:
+            # Files are read and written without the lock, so TTS threads don't
+            # wait on each other's disk I/O
+            path = self._path(key)
+            cached = audio
+            try:
+                if audio is None:
+                    with open(path, "rb") as f:
+                        audio = f.read()
+                os.utime(path)
+            except OSError:
+                # Evicted meanwhile, or gone from the disk
+                with self._lock:
+                    self._forget_disk(key)
+                return cached
+
+            if cached is None:
+                with self._lock:
+                    self._remember(key, audio)
+        return audio
+
+    def put(self, text, audio):
+        if not audio:
+            return
+        key = self.key(text)
+        with self._lock:
+            self._remember(key, audio)
+            store = (
+                0 < len(audio) <= self.disk_bytes
+                and key not in self._disk
+                and key not in self._storing
+            )
+            if store:
+                self._storing.add(key)
+        if not store:
+            return
+
+        stored = self._store(key, audio)
+        with self._lock:
+            self._storing.discard(key)
+            if stored:
+                self._disk[key] = len(audio)
+                self._disk_size += len(audio)
+            evicted = self._trim_disk()
+        self._remove(evicted)
+
+    def _remember(self, key, audio):
+        if len(audio) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pcm")
+
+    def _store(self, key, audio):
+        """Writes `audio` to a temporary file, then moves it into place."""
+        path = self._path(key)
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Couldn't cache TTS audio: {e}")
+            return False
+        return True
+
+    def _trim_disk(self):
+        """Takes the oldest entries out of the index, returns them to be removed."""
+        evicted = []
+        while self._disk_size > self.disk_bytes:
+            oldest = next(iter(self._disk))
+            self._forget_disk(oldest)
+            evicted.append(oldest)
+        return evicted
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _forget_disk(self, key):
+        self._disk_size -= self._disk.pop(key, 0)
+
+    def _load_disk_index(self):
+        """Picks up what earlier runs cached, in the order it was last used."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                if not name.endswith(".pcm"):
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[: -len(".pcm")], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._remove(self._trim_disk())
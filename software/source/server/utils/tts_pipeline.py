@@ -0,0 +1,103 @@
+import asyncio
+import inspect
+import os
+import traceback
+
+from .async_stream import iterate_in_thread
+from .logs import setup_logging
+from .logs import logger
+
+setup_logging()
+
+# How many sentences are synthesized ahead of the one being sent
+LOOKAHEAD = int(os.getenv("TTS_LOOKAHEAD", 2))
+
+_END = object()
+
+
+class TtsPipeline:
+    """
+    Speaks one reply's sentences strictly in order, while the next `lookahead`
+    sentences are already being synthesized in worker threads.
+
+    `synthesize(sentence, urgent)` is a generator of audio chunks, run in a worker
+    thread, or an async generator. `send(chunks)` is a coroutine that streams an
+    async iterator of them to the device.
+
+    `urgent` is true for the reply's first sentence, which the listener is
+    already waiting on.
+
+    `say` only waits when `lookahead` sentences are already queued, so the LLM
+    stream keeps flowing while audio is produced and sent. Sentences that don't
+    produce any audio aren't sent at all.
+    """
+
+    def __init__(self, synthesize, send, lookahead=LOOKAHEAD):
+        self.synthesize = synthesize
+        self.send = send
+        self._slots = asyncio.Semaphore(lookahead + 1)
+        self._jobs = asyncio.Queue()
+        self._synthesizers = set()
+        self._said = 0
+        self._sender = asyncio.create_task(self._send_in_order())
+
+    async def say(self, sentence):
+        await self._slots.acquire()
+        chunks = asyncio.Queue()
+        urgent = self._said == 0
+        self._said += 1
+        task = asyncio.create_task(self._synthesize(sentence, urgent, chunks))
+        self._synthesizers.add(task)
+        task.add_done_callback(self._synthesizers.discard)
+        await self._jobs.put(chunks)
+
+    async def close(self):
+        """Waits until everything that was said has been sent."""
+        await self._jobs.put(_END)
+        await self._sender
+
+    def cancel(self):
+        self._sender.cancel()
+        for task in list(self._synthesizers):
+            task.cancel()
+
+    async def _synthesize(self, sentence, urgent, chunks):
+        if inspect.isasyncgenfunction(self.synthesize):
+            audio = self.synthesize(sentence, urgent)
+        else:
+            audio = iterate_in_thread(self.synthesize, sentence, urgent)
+        try:
+            async for chunk in audio:
+                chunks.put_nowait(chunk)
+        except Exception:
+            logger.error(
+                f"Failed to synthesize {sentence!r}:\n{traceback.format_exc()}"
+            )
+        finally:
+            chunks.put_nowait(_END)
+            await audio.aclose()
+
+    async def _send_in_order(self):
+        while True:
+            chunks = await self._jobs.get()
+            if chunks is _END:
+                return
+            try:
+                first = await chunks.get()
+                if first is _END:
+                    # Nothing to say, the sentence failed (or was silent)
+                    continue
+                await self.send(self._drain(first, chunks))
+            except Exception:
+                logger.error(f"Failed to send audio:\n{traceback.format_exc()}")
+            finally:
+                self._slots.release()
+
+    @staticmethod
+    async def _drain(first, chunks):
+        yield first
+        while True:
+            chunk = await chunks.get()
+            if chunk is _END:
+                return
+            yield chunk
@@ -0,0 +1,56 @@
+"""
+Energy based voice activity detection for 16kHz mono s16le audio, so silence
+isn't sent to STT.
+"""
+
+import os
+
+import numpy as np
+
+from ...utils import audio
+
+# Loudness is measured over 30ms frames
+FRAME = audio.SAMPLE_RATE * 30 // 1000
+# No frame quieter than this counts as speech, however quiet the room is
+MIN_LEVEL = float(os.getenv("VAD_MIN_LEVEL", 150))
+# Less speech than this is a click or a bump, not someone talking
+MIN_SPEECH_SECONDS = float(os.getenv("VAD_MIN_SPEECH_SECONDS", 0.15))
+# Silence kept around the speech, so words aren't clipped
+PADDING_SECONDS = 0.2
+
+
+def frame_levels(pcm):
+    """The RMS loudness of each whole frame of `pcm`."""
+    count = len(pcm) // (FRAME * 2)
+    samples = np.frombuffer(pcm, dtype="<i2", count=count * FRAME)
+    frames = samples.reshape(count, FRAME).astype(np.float32)
+    return np.sqrt(np.mean(frames**2, axis=1))
+
+
+def speech_level(levels):
+    """
+    How loud a frame has to be to count as speech: well above the noise floor
+    (the quietest frames), but never above the loud parts, in case it's all speech.
+    """
+    if len(levels) == 0:
+        return MIN_LEVEL
+    noise, loud = np.percentile(levels, [10, 95])
+    return max(MIN_LEVEL, min(3 * noise, 0.3 * loud))
+
+
+def trim(pcm):
+    """
+    Cuts the silence off both ends of `pcm`. Returns the rest (a memoryview of
+    `pcm`, empty if there was no speech) and how many seconds of it are speech.
+    """
+    levels = frame_levels(pcm)
+    speech = np.flatnonzero(levels >= speech_level(levels))
+    seconds = speech.size * FRAME / audio.SAMPLE_RATE
+    if seconds < MIN_SPEECH_SECONDS:
+        return memoryview(b""), 0.0
+
+    padding = int(PADDING_SECONDS * audio.SAMPLE_RATE) // FRAME
+    start = max(0, speech[0] - padding) * FRAME * 2
+    end = speech[-1] + 1 + padding
+    end = len(pcm) if end >= len(levels) else end * FRAME * 2
+    return memoryview(pcm)[start:end], seconds
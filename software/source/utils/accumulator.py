@@ -1,7 +1,68 @@
+# What's returned for an end flag that didn't end anything
+_EMPTY = {"role": None, "type": None, "format": None, "content": None}
+
+
+class _Message:
+    """
+    A message that's still coming in. Its content arrives in pieces, which are
+    only joined once, when the message is done, instead of copying everything
+    received so far with every piece.
+    """
+
+    __slots__ = ("fields", "base", "parts")
+
+    def __init__(self, chunk=None):
+        # Everything but the content (and the start flag)
+        self.fields = {
+            key: value
+            for key, value in (chunk or _EMPTY).items()
+            if key not in ("start", "content")
+        }
+        # The first piece of content, which decides what the rest has to be
+        self.base = None
+        self.parts = []
+        if chunk and chunk.get("content") is not None:
+            self.add(chunk["content"])
+
+    def matches(self, chunk):
+        return all(chunk.get(key) == value for key, value in self.fields.items())
+
+    def add(self, content):
+        if self.base is None:
+            self.base = content
+        elif type(content) == dict and type(self.base) == dict:
+            # dict concatenation cannot happen, so only the inner content is kept
+            self.parts.append(content["content"])
+        elif type(content) == type(self.base):
+            self.parts.append(content)
+
+    def add_bytes(self, data):
+        """Raw bytes replace content of any other type."""
+        if type(self.base) != bytes:
+            self.base = b""
+            self.parts = []
+        self.parts.append(data)
+
+    def build(self):
+        message = dict(self.fields)
+        if type(self.base) == dict:
+            content = dict(self.base)
+            content["content"] = content["content"] + "".join(self.parts)
+        elif self.parts:
+            content = self.base + type(self.base)().join(self.parts)
+        else:
+            content = self.base
+        message["content"] = content
+        return message
+
+
 class Accumulator:
+    __slots__ = ("message", "audio")
+
     def __init__(self):
-        self.template = {"role": None, "type": None, "format": None, "content": None}
-        self.message = self.template
+        self.message = _Message()
+        # Audio is accumulated on its own, since text can arrive in the middle of it
+        self.audio = None
 
     def accumulate(self, chunk):
         # print(str(chunk)[:100])
@@ -10,38 +71,48 @@ class Accumulator:
                 # We don't do anything with these
                 return None
 
+            if chunk.get("type") == "audio" and (
+                "start" in chunk or self.audio is not None
+            ):
+                return self.accumulate_audio(chunk)
+
             if "start" in chunk:
-                self.message = chunk
-                self.message.pop("start")
+                self.message = _Message(chunk)
                 return None
 
             if "content" in chunk:
-                if any(
-                    self.message[key] != chunk[key]
-                    for key in self.message
-                    if key != "content"
-                ):
-                    self.message = chunk
-                if "content" not in self.message:
-                    self.message["content"] = chunk["content"]
+                if not self.message.matches(chunk):
+                    self.message = _Message(chunk)
                 else:
-                    if type(chunk["content"]) == dict:
-                        # dict concatenation cannot happen, so we see if chunk is a dict
-                        self.message["content"]["content"] += chunk["content"][
-                            "content"
-                        ]
-                    else:
-                        self.message["content"] += chunk["content"]
+                    self.message.add(chunk["content"])
                 return None
 
             if "end" in chunk:
                 # We will proceed
-                message = self.message
-                self.message = self.template
+                message = self.message.build()
+                self.message = _Message()
                 return message
 
         if type(chunk) == bytes:
-            if "content" not in self.message or type(self.message["content"]) != bytes:
-                self.message["content"] = b""
-            self.message["content"] += chunk
+            if self.audio is not None:
+                return self.accumulate_audio(chunk)
+            self.message.add_bytes(chunk)
+            return None
+
+    def accumulate_audio(self, chunk):
+        if type(chunk) == bytes:
+            self.audio.add_bytes(chunk)
             return None
+
+        if "start" in chunk:
+            self.audio = _Message(chunk)
+            return None
+
+        if "end" in chunk:
+            message = self.audio.build()
+            self.audio = None
+            return message
+
+        if "content" in chunk:
+            self.audio.add(chunk["content"])
+        return None
@@ -0,0 +1,462 @@
+"""
+In-process audio conversion: WAV parsing and writing, sample format conversion,
+downmixing and resampling, so the usual hops (device WAV to STT, TTS voice to
+device) don't need an ffmpeg process. Only compressed codecs still go through
+ffmpeg.
+
+Samples are NumPy arrays, shaped (frames, channels) until they're downmixed.
+"""
+
+import math
+import struct
+import threading
+
+import ffmpeg
+import numpy as np
+
+# What STT takes and devices play: 16kHz mono s16le
+SAMPLE_RATE = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Streamed WAVs don't know their size up front, and say so with these
+UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+EMPTY = np.zeros(0, dtype=np.int16)
+
+# Headerless audio, which is always 16kHz mono s16le
+RAW_MIME_TYPES = ("audio/raw", "audio/dat", "audio/pcm")
+
+
+class UnsupportedAudio(ValueError):
+    """Audio that can't be converted in-process."""
+
+
+class WavInfo:
+    def __init__(self, sample_rate, channels, sample_width, is_float, data_offset):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.is_float = is_float
+        self.data_offset = data_offset
+
+    @property
+    def is_device_format(self):
+        return (
+            self.sample_rate == SAMPLE_RATE
+            and self.channels == CHANNELS
+            and self.sample_width == SAMPLE_WIDTH
+            and not self.is_float
+        )
+
+
+def parse_wav_header(data):
+    """Reads the format of a WAV, and where its samples start."""
+    data = memoryview(data)
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise UnsupportedAudio("Not a WAV file")
+
+    fmt = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = bytes(data[position : position + 4])
+        (size,) = struct.unpack_from("<I", data, position + 4)
+        body = position + 8
+
+        if chunk_id == b"fmt ":
+            if body + min(size, 26) > len(data):
+                raise UnsupportedAudio("Cut off WAV header")
+            tag, channels, sample_rate = struct.unpack_from("<HHI", data, body)
+            (bits,) = struct.unpack_from("<H", data, body + 14)
+            if tag == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                (tag,) = struct.unpack_from("<H", data, body + 24)
+            if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                raise UnsupportedAudio(f"Compressed WAV (format {tag:#06x})")
+            is_float = tag == WAVE_FORMAT_IEEE_FLOAT
+            # Known from the header, so nothing has to be decoded to find out
+            if bits not in ((32, 64) if is_float else (8, 16, 24, 32)):
+                raise UnsupportedAudio(f"{bits} bit WAV")
+            if not channels:
+                raise UnsupportedAudio("WAV without channels")
+            fmt = (sample_rate, channels, bits // 8, is_float)
+
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise UnsupportedAudio("WAV data before its format")
+            return WavInfo(*fmt, data_offset=body)
+
+        if size in UNKNOWN_SIZES:
+            break
+        # Chunks are padded to an even size
+        position = body + size + (size & 1)
+
+    raise UnsupportedAudio("WAV without samples")
+
+
+def read_wav(data):
+    """Returns the samples of a WAV, and its sample rate."""
+    info = parse_wav_header(data)
+    payload = memoryview(data)[info.data_offset :]
+    frame_size = info.sample_width * info.channels
+    payload = payload[: len(payload) // frame_size * frame_size]
+    samples = decode_pcm(payload, info.sample_width, info.is_float)
+    return samples.reshape(-1, info.channels), info.sample_rate
+
+
+def decode_pcm(payload, sample_width, is_float=False):
+    """Little endian PCM as a flat array of its samples."""
+    if is_float:
+        return np.frombuffer(payload, dtype=f"<f{sample_width}")
+    if sample_width == 1:
+        # 8 bit WAV is unsigned
+        return np.frombuffer(payload, dtype=np.uint8).astype(np.int16) - 128 << 8
+    if sample_width == 3:
+        raw = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 3)
+        samples = raw[:, 0].astype(np.int32) << 8
+        samples |= raw[:, 1].astype(np.int32) << 16
+        samples |= raw[:, 2].astype(np.int32) << 24
+        return samples
+    if sample_width in (2, 4):
+        return np.frombuffer(payload, dtype=f"<i{sample_width}")
+    raise UnsupportedAudio(f"{sample_width * 8} bit WAV")
+
+
+def to_int16(samples):
+    """Converts integer or float (-1 to 1) samples to int16."""
+    if samples.dtype == np.int16:
+        return samples
+    if samples.dtype.kind == "f":
+        return np.clip(np.rint(samples * 32768), -32768, 32767).astype(np.int16)
+    shift = samples.dtype.itemsize * 8 - 16
+    return (samples >> shift).astype(np.int16)
+
+
+def to_mono(samples):
+    """Averages the channels of (frames, channels) samples."""
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def wav_header(sample_rate=SAMPLE_RATE, channels=CHANNELS, data_size=0xFFFFFFFF):
+    """A 16 bit PCM WAV header. Leave out `data_size` when streaming."""
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    byte_rate = sample_rate * channels * SAMPLE_WIDTH
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        riff_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        WAVE_FORMAT_PCM,
+        channels,
+        sample_rate,
+        byte_rate,
+        channels * SAMPLE_WIDTH,
+        SAMPLE_WIDTH * 8,
+        b"data",
+        data_size,
+    )
+
+
+def to_wav(pcm, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Wraps s16le PCM in a WAV."""
+    pcm = bytes(pcm)
+    return wav_header(sample_rate, channels, len(pcm)) + pcm
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler with a Kaiser windowed sinc low-pass, for mono
+    audio. Feed it chunks as they come, the output lines up exactly with
+    resampling all of it at once.
+    """
+
+    # Zero crossings of the sinc on each side, and how far below Nyquist to cut
+    ZERO_CROSSINGS = 8
+    ROLLOFF = 0.9
+    BETA = 8.0
+    # Outputs computed at a time, to bound memory on long inputs
+    BLOCK = 8192
+
+    def __init__(self, from_rate, to_rate=SAMPLE_RATE):
+        divisor = math.gcd(int(from_rate), int(to_rate))
+        self.up = int(to_rate) // divisor
+        self.down = int(from_rate) // divisor
+
+        # Taps per phase, i.e. how many input samples each output is made of
+        cutoff = self.ROLLOFF / max(self.up, self.down)
+        self.taps = math.ceil(2 * self.ZERO_CROSSINGS / (cutoff * self.up))
+        length = self.taps * self.up
+        # Centered on a whole sample, so the output isn't shifted by half of one
+        self.delay = (length - 1) // 2
+        symmetric = 2 * self.delay + 1
+        t = np.arange(symmetric) - self.delay
+        prototype = np.zeros(length)
+        prototype[:symmetric] = (
+            self.up * cutoff * np.sinc(cutoff * t) * np.kaiser(symmetric, self.BETA)
+        )
+        # phases[p, k] weighs input sample base - k for output phase p
+        self.phases = prototype.reshape(self.taps, self.up).T.astype(np.float32)
+
+        # Input samples still needed, starting at input index `offset`. Starts with
+        # silence in front of the audio
+        self.buffer = np.zeros(self.taps - 1, dtype=np.float32)
+        self.offset = -(self.taps - 1)
+        self.received = 0
+        self.produced = 0
+
+    def process(self, samples, final=False):
+        """Resamples the next chunk of int16 samples, returning int16 samples."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.up == self.down:
+            return to_int16(samples / 32768) if samples.size else EMPTY
+        self.buffer = np.concatenate([self.buffer, samples])
+        self.received += samples.size
+
+        if final:
+            end = -(-self.received * self.up // self.down)
+            # Enough silence after the audio for the last outputs
+            padding = self.delay // self.up + 2
+            self.buffer = np.concatenate(
+                [self.buffer, np.zeros(padding, dtype=np.float32)]
+            )
+        else:
+            end = -(-(self.received * self.up - self.delay) // self.down)
+        end = max(end, self.produced)
+
+        outputs = []
+        for start in range(self.produced, end, self.BLOCK):
+            n = np.arange(start, min(start + self.BLOCK, end))
+            position = n * self.down + self.delay
+            base = position // self.up - self.offset
+            gathered = self.buffer[base[:, None] - np.arange(self.taps)[None, :]]
+            weights = self.phases[position % self.up]
+            outputs.append(np.einsum("ij,ij->i", gathered, weights))
+        self.produced = end
+
+        # Keep only what later outputs need
+        next_base = (end * self.down + self.delay) // self.up - self.offset
+        drop = max(0, min(next_base - self.taps + 1, self.buffer.size))
+        self.buffer = self.buffer[drop:]
+        self.offset += drop
+
+        if not outputs:
+            return EMPTY
+        return to_int16(np.concatenate(outputs) / 32768)
+
+
+def resample(samples, from_rate, to_rate=SAMPLE_RATE):
+    """Resamples mono int16 samples."""
+    if from_rate == to_rate:
+        return to_int16(np.asarray(samples))
+    return Resampler(from_rate, to_rate).process(samples, final=True)
+
+
+def to_mono_int16(samples):
+    """(frames, channels) samples of any format as mono int16 samples."""
+    mono = to_mono(samples)
+    if mono.dtype.kind == "f" and samples.dtype.kind != "f":
+        # A downmix of integer samples, still at their scale
+        mono = mono / float(2 ** (samples.dtype.itemsize * 8 - 1))
+    return to_int16(mono)
+
+
+def to_device_pcm(samples, sample_rate):
+    """(frames, channels) samples of any format as 16kHz mono s16le bytes."""
+    return resample(to_mono_int16(samples), sample_rate).tobytes()
+
+
+class StreamResampler:
+    """Resamples a stream of mono s16le bytes, cut anywhere, to 16kHz."""
+
+    def __init__(self, from_rate):
+        self.resampler = Resampler(from_rate)
+        self.odd_byte = b""
+
+    def feed(self, data):
+        # Pieces can split a sample
+        data = self.odd_byte + bytes(data)
+        usable = len(data) // 2 * 2
+        self.odd_byte = data[usable:]
+        samples = np.frombuffer(data, dtype="<i2", count=usable // 2)
+        return self.resampler.process(samples).tobytes()
+
+    def flush(self):
+        return self.resampler.process(EMPTY, final=True).tobytes()
+
+
+class StreamConverter:
+    """
+    Turns audio that arrives in pieces, either raw 16kHz mono s16le or a WAV
+    (streamed or not), into 16kHz mono s16le as it comes in. Pieces don't have
+    to line up with samples, or with the end of the WAV header.
+    """
+
+    # A header that hasn't parsed by now isn't going to
+    MAX_HEADER = 4096
+
+    def __init__(self):
+        self.pending = bytearray()
+        self.info = None
+        self.raw = None
+        self.resampler = None
+
+    def feed(self, data):
+        """Returns the 16kHz mono s16le bytes `data` completes."""
+        self.pending += data
+        if self.raw is None and not self._read_header():
+            return b""
+
+        if self.raw:
+            frame_size = SAMPLE_WIDTH
+        else:
+            frame_size = self.info.sample_width * self.info.channels
+        usable = len(self.pending) // frame_size * frame_size
+        if not usable:
+            return b""
+        payload = bytes(self.pending[:usable])
+        del self.pending[:usable]
+
+        if self.raw or self.info.is_device_format:
+            return payload
+        samples = decode_pcm(payload, self.info.sample_width, self.info.is_float)
+        samples = to_mono_int16(samples.reshape(-1, self.info.channels))
+        if self.resampler:
+            samples = self.resampler.process(samples)
+        return samples.tobytes()
+
+    def flush(self):
+        """Returns what the resampler still holds, once all the audio is in."""
+        if self.resampler is None:
+            return b""
+        return self.resampler.process(EMPTY, final=True).tobytes()
+
+    def _read_header(self):
+        if len(self.pending) < 12:
+            return False
+        if not is_wav(self.pending):
+            self.raw = True
+            return True
+        try:
+            self.info = parse_wav_header(self.pending)
+        except UnsupportedAudio:
+            if len(self.pending) < self.MAX_HEADER:
+                return False
+            raise
+        # A header cut off inside its fmt chunk can still look complete
+        if len(self.pending) < self.info.data_offset:
+            return False
+        del self.pending[: self.info.data_offset]
+        self.raw = False
+        if self.info.sample_rate != SAMPLE_RATE:
+            self.resampler = Resampler(self.info.sample_rate)
+        return True
+
+
+def ffmpeg_to_device_pcm(data, input_format=None):
+    """Decodes compressed audio with ffmpeg, over pipes."""
+    options = {"f": input_format} if input_format else {}
+    pcm, _ = (
+        ffmpeg.input("pipe:", **options)
+        .output(
+            "pipe:",
+            f="s16le",
+            acodec="pcm_s16le",
+            ac=CHANNELS,
+            ar=SAMPLE_RATE,
+            loglevel="panic",
+        )
+        .run(input=bytes(data), capture_stdout=True)
+    )
+    return pcm
+
+
+class OpusEncoder:
+    """
+    Encodes 16kHz mono s16le into Ogg Opus as it's fed, with an ffmpeg process.
+    What's encoded comes back from later calls, ffmpeg works in pages.
+    """
+
+    def __init__(self, bitrate="24k"):
+        self.process = (
+            ffmpeg.input(
+                "pipe:", f="s16le", acodec="pcm_s16le", ac=CHANNELS, ar=SAMPLE_RATE
+            )
+            .output(
+                "pipe:",
+                f="ogg",
+                acodec="libopus",
+                audio_bitrate=bitrate,
+                application="voip",
+                flush_packets=1,
+                loglevel="panic",
+            )
+            .run_async(pipe_stdin=True, pipe_stdout=True)
+        )
+        self.encoded = bytearray()
+        self.lock = threading.Lock()
+        # Read as it's written, so ffmpeg never blocks on a full pipe
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def feed(self, pcm):
+        self.process.stdin.write(pcm)
+        self.process.stdin.flush()
+        return self._take()
+
+    def flush(self):
+        """Returns the rest, once all the audio has been fed."""
+        self.process.stdin.close()
+        self.reader.join()
+        self.process.wait()
+        return self._take()
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read1(4096)
+            if not data:
+                return
+            with self.lock:
+                self.encoded += data
+
+    def _take(self):
+        with self.lock:
+            encoded = bytes(self.encoded)
+            self.encoded.clear()
+        return encoded
+
+
+def is_wav(data):
+    return bytes(data[:4]) == b"RIFF" and bytes(data[8:12]) == b"WAVE"
+
+
+def to_16k_pcm(data, mime_type):
+    """
+    Any audio a device sends (raw 16kHz s16le, WAV, or a compressed format) as
+    16kHz mono s16le.
+
+    The header decides, not the mime type. Audio that already is 16kHz mono
+    s16le is passed through as a memoryview of `data`, without a copy, anything
+    else is converted exactly once.
+    """
+    if is_wav(data):
+        try:
+            info = parse_wav_header(data)
+        except UnsupportedAudio:
+            return ffmpeg_to_device_pcm(data)
+        if info.is_device_format:
+            payload = memoryview(data)[info.data_offset :]
+            return payload[: len(payload) // 2 * 2]
+        samples, sample_rate = read_wav(data)
+        return to_device_pcm(samples, sample_rate)
+    if mime_type in RAW_MIME_TYPES:
+        return memoryview(data)
+    return ffmpeg_to_device_pcm(data)
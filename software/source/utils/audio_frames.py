@@ -0,0 +1,157 @@
+"""
+Framing for the PCM audio the server streams to devices.
+
+Devices that don't ask for anything get the original stream: bare 1024 byte
+slices of 16kHz mono s16le. Devices that send a config message asking for
+"framed" audio get one websocket frame per `frame_ms` of audio, each starting
+with a small header:
+
+    version (u8) | flags (u8) | channels (u8) | pad | sample rate (u16) | sequence (u32)
+
+all little endian. The sequence number restarts at 0 with every audio message,
+and the last frame of a message has FLAG_LAST set.
+"""
+
+import struct
+from collections import namedtuple
+
+HEADER = struct.Struct("<BBBxHI")
+VERSION = 1
+FLAG_LAST = 1
+
+SAMPLE_RATE = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+RAW_CHUNK_SIZE = 1024
+DEFAULT_FRAME_MS = 60
+MIN_FRAME_MS = 20
+MAX_FRAME_MS = 100
+
+FrameHeader = namedtuple(
+    "FrameHeader", ["version", "flags", "channels", "sample_rate", "sequence"]
+)
+
+# What a device gets until it asks for something else
+RAW = {"audio_framing": "raw", "chunk_size": RAW_CHUNK_SIZE}
+
+# What devices record in, unless both sides agree on something smaller
+DEFAULT_INPUT_FORMAT = "bytes.wav"
+
+
+def negotiate(requested, input_formats=(DEFAULT_INPUT_FORMAT,)):
+    """
+    Returns the audio settings the server will use, given what a device asked
+    for, and the format the device should record in: the first of the ones it
+    offered (best first) that's in `input_formats`.
+    """
+    input_format = DEFAULT_INPUT_FORMAT
+    for offered in requested.get("input_formats") or []:
+        if offered in input_formats:
+            input_format = offered
+            break
+
+    if requested.get("audio_framing") != "framed":
+        return {**RAW, "input_format": input_format}
+
+    try:
+        frame_ms = int(requested.get("frame_ms", DEFAULT_FRAME_MS))
+    except (TypeError, ValueError):
+        frame_ms = DEFAULT_FRAME_MS
+    frame_ms = min(max(frame_ms, MIN_FRAME_MS), MAX_FRAME_MS)
+
+    return {
+        "audio_framing": "framed",
+        "frame_ms": frame_ms,
+        "sample_rate": SAMPLE_RATE,
+        "channels": CHANNELS,
+        "sample_format": "s16le",
+        "input_format": input_format,
+    }
+
+
+def frame_size(frame_ms, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Bytes of PCM in a frame of `frame_ms` milliseconds."""
+    return sample_rate * frame_ms // 1000 * channels * SAMPLE_WIDTH
+
+
+def pack(payload, sequence, last=False, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    flags = FLAG_LAST if last else 0
+    return HEADER.pack(VERSION, flags, channels, sample_rate, sequence) + bytes(payload)
+
+
+def unpack(frame):
+    """Returns the header of a frame and a memoryview of its PCM."""
+    header = FrameHeader(*HEADER.unpack_from(frame))
+    if header.version != VERSION:
+        raise ValueError(f"Unsupported audio frame version: {header.version}")
+    return header, memoryview(frame)[HEADER.size :]
+
+
+class Framer:
+    """
+    Cuts a stream of PCM into the websocket frames `settings` (from `negotiate`) asks for.
+
+    In framed mode the last full frame is held back until more audio arrives or
+    `flush` is called, so the final frame can carry FLAG_LAST.
+    """
+
+    def __init__(self, settings):
+        self.framed = settings["audio_framing"] == "framed"
+        if self.framed:
+            self.sample_rate = settings["sample_rate"]
+            self.channels = settings["channels"]
+            self.size = frame_size(
+                settings["frame_ms"], self.sample_rate, self.channels
+            )
+        else:
+            self.size = settings["chunk_size"]
+        self.sequence = 0
+        self.buffer = bytearray()
+
+    def _frame(self, payload, last=False):
+        if not self.framed:
+            return bytes(payload)
+        frame = pack(
+            payload,
+            self.sequence,
+            last=last,
+            sample_rate=self.sample_rate,
+            channels=self.channels,
+        )
+        self.sequence += 1
+        return frame
+
+    def feed(self, pcm):
+        self.buffer += pcm
+        # Keep the last frame back in framed mode, it might be the final one
+        keep = 1 if self.framed else 0
+        count = len(self.buffer) // self.size
+        if count and len(self.buffer) == count * self.size:
+            count -= keep
+        if count <= 0:
+            return []
+        view = memoryview(self.buffer)
+        frames = [
+            self._frame(view[i * self.size : (i + 1) * self.size]) for i in range(count)
+        ]
+        view.release()
+        del self.buffer[: count * self.size]
+        return frames
+
+    def flush(self):
+        view = memoryview(self.buffer)
+        frames = [
+            self._frame(view[i : i + self.size], last=i + self.size >= len(self.buffer))
+            for i in range(0, len(self.buffer), self.size)
+        ]
+        view.release()
+        self.buffer.clear()
+        self.sequence = 0
+        return frames
+
+
+def split(audio_bytes, settings):
+    """Cuts a whole audio message into websocket frames."""
+    framer = Framer(settings)
+    return framer.feed(audio_bytes) + framer.flush()
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+
+from .waiters import wake_soon
+
+
+class RingBuffer:
+    """
+    A fixed-size FIFO of bytes, allocated once. Safe to write from one thread
+    (say, the network) and read from another (say, an audio callback).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.start = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def free(self):
+        return self.capacity - self.size
+
+    def write(self, data, overwrite=False):
+        """
+        Writes as much of `data` as fits and returns how much that was. With
+        `overwrite`, all of it is written, pushing out the oldest bytes.
+        """
+        with self.lock:
+            return self._write(memoryview(data).cast("B"), overwrite)
+
+    def read(self, size):
+        """Takes up to `size` of the oldest bytes."""
+        out = bytearray(min(size, self.size))
+        with self.lock:
+            return bytes(out[: self._read_into(memoryview(out))])
+
+    def read_into(self, out):
+        """Fills as much of the writable buffer `out` as it can, returns how much."""
+        with self.lock:
+            return self._read_into(memoryview(out).cast("B"))
+
+    def keep_last(self, size):
+        """Drops all but the newest `size` bytes, returns how many are left."""
+        with self.lock:
+            self._discard(max(0, self.size - size))
+            return self.size
+
+    def clear(self):
+        with self.lock:
+            self.start = 0
+            self.size = 0
+
+    def _write(self, data, overwrite):
+        if overwrite:
+            if len(data) > self.capacity:
+                data = data[-self.capacity :]
+            pushed_out = max(0, len(data) - self.free())
+            self._discard(pushed_out)
+        else:
+            data = data[: self.free()]
+
+        end = (self.start + self.size) % self.capacity
+        first = min(len(data), self.capacity - end)
+        self.buffer[end : end + first] = data[:first]
+        self.buffer[: len(data) - first] = data[first:]
+        self.size += len(data)
+        return len(data)
+
+    def _read_into(self, out):
+        count = min(len(out), self.size)
+        first = min(count, self.capacity - self.start)
+        out[:first] = self.buffer[self.start : self.start + first]
+        out[first:count] = self.buffer[: count - first]
+        self._discard(count)
+        return count
+
+    def _discard(self, count):
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+        if self.size == 0:
+            self.start = 0
+
+
+class JitterBuffer(RingBuffer):
+    """
+    Audio on its way to the speaker. Playback only starts once `prebuffer`
+    bytes are in (or the audio has ended), and waits for that much again after
+    running dry, so a late packet makes one short pause instead of crackling.
+
+    The event loop can `wait_for_space` when it's full, and is woken by the
+    audio callback once some of it has been played.
+    """
+
+    def __init__(self, capacity, prebuffer):
+        super().__init__(capacity)
+        self.prebuffer = min(prebuffer, capacity)
+        self.playing = False
+        self.ended = True
+        self.loop = None
+        self.waiter = None
+
+    def begin(self):
+        """More audio is on its way."""
+        with self.lock:
+            self.ended = False
+
+    def end(self):
+        """No more audio is coming, what's left can be played however short."""
+        with self.lock:
+            self.ended = True
+
+    async def wait_for_space(self):
+        """Waits until there's room for more, if it's full."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.size < self.capacity:
+                return
+            self.loop = loop
+            self.waiter = waiter = loop.create_future()
+        await waiter
+
+    def fill(self, out):
+        """Fills `out` with what's ready to be played, and silence after that."""
+        out = memoryview(out).cast("B")
+        waiter = None
+        with self.lock:
+            if not self.playing:
+                self.playing = self.size >= self.prebuffer or (
+                    self.ended and self.size > 0
+                )
+            count = self._read_into(out) if self.playing else 0
+            if count < len(out):
+                self.playing = False
+            # Room was made by this, or by a clear since
+            if self.waiter is not None and self.size < self.capacity:
+                waiter, self.waiter = self.waiter, None
+        out[count:] = bytes(len(out) - count)
+        if waiter is not None:
+            wake_soon(self.loop, waiter)
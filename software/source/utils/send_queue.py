@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from collections import deque
+
+from .waiters import wake_soon
+
+# Consecutive audio chunks are sent as one message of up to this many bytes
+MAX_BATCH_BYTES = 16384
+
+
+class SendQueue:
+    """
+    Messages on their way to the server. Any thread can `put` (the recorder,
+    the kernel watcher, the code runner), and the event loop awaits `get`.
+
+    Audio bytes that are already waiting next to each other come out joined,
+    up to `max_batch` bytes, so a recording goes out in fewer, larger
+    messages. Nothing waits for more to arrive, so batching adds no delay.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH_BYTES):
+        self.max_batch = max_batch
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.loop = None
+        self.waiter = None
+
+    def put(self, message):
+        with self.lock:
+            self.items.append(message)
+            waiter, self.waiter = self.waiter, None
+        if waiter is not None:
+            wake_soon(self.loop, waiter)
+
+    async def get(self):
+        self.loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                if self.items:
+                    return self._take()
+                self.waiter = self.loop.create_future()
+                waiter = self.waiter
+            await waiter
+
+    def empty(self):
+        return not self.items
+
+    def _take(self):
+        message = self.items.popleft()
+        if not isinstance(message, bytes):
+            return message
+
+        size = len(message)
+        batch = [message]
+        while (
+            self.items
+            and isinstance(self.items[0], bytes)
+            and size + len(self.items[0]) <= self.max_batch
+        ):
+            batch.append(self.items.popleft())
+            size += len(batch[-1])
+        return b"".join(batch) if len(batch) > 1 else message
@@ -0,0 +1,11 @@
+def wake_soon(loop, waiter):
+    """
+    Wakes up whoever awaits `waiter` (a future of `loop`), from any thread,
+    unless they've stopped waiting.
+    """
+    loop.call_soon_threadsafe(_wake, waiter)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,47 @@
+from source.utils.accumulator import Accumulator
+
+
+def test_text_and_audio_are_accumulated_separately():
+    accumulator = Accumulator()
+    chunks = [
+        {"role": "user", "type": "audio", "format": "bytes.wav", "start": True},
+        b"RIFF",
+        {"role": "user", "type": "message", "start": True},
+        {"role": "user", "type": "message", "content": "Hello"},
+        b"data",
+        {"role": "user", "type": "message", "content": " there"},
+        {"role": "user", "type": "message", "end": True},
+        b"more",
+        {"role": "user", "type": "audio", "format": "bytes.wav", "end": True},
+    ]
+    messages = [accumulator.accumulate(chunk) for chunk in chunks]
+    messages = [message for message in messages if message is not None]
+
+    assert messages == [
+        {"role": "user", "type": "message", "content": "Hello there"},
+        {
+            "role": "user",
+            "type": "audio",
+            "format": "bytes.wav",
+            "content": b"RIFFdatamore",
+        },
+    ]
+    # The chunks themselves are left alone
+    assert chunks[0]["start"] is True
+
+
+def test_console_output_and_unstarted_messages():
+    accumulator = Accumulator()
+    output = {"role": "computer", "type": "console", "format": "output"}
+    accumulator.accumulate({**output, "content": {"content": "a"}})
+    accumulator.accumulate({**output, "content": {"content": "b"}})
+    assert accumulator.accumulate({**output, "end": True}) == {
+        **output,
+        "content": {"content": "ab"},
+    }
+    assert accumulator.accumulate({"role": "user", "end": True}) == {
+        "role": None,
+        "type": None,
+        "format": None,
+        "content": None,
+    }
@@ -0,0 +1,53 @@
+import io
+import wave
+
+import numpy as np
+
+from source.utils import audio
+
+
+def sine(frequency, sample_rate, seconds=1.0):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (np.sin(2 * np.pi * frequency * t) * 16000).astype(np.int16)
+
+
+def test_resampling_keeps_the_tone_and_streams_like_one_shot():
+    for sample_rate in (44100, 22050, 24000, 8000):
+        samples = sine(1000, sample_rate)
+        resampled = audio.resample(samples, sample_rate)
+
+        assert len(resampled) == audio.SAMPLE_RATE
+        expected = sine(1000, audio.SAMPLE_RATE)
+        assert np.abs(resampled[100:-100] - expected[100:-100]).max() <= 4
+
+        resampler = audio.Resampler(sample_rate)
+        cuts = list(range(0, len(samples), 777)) + [len(samples)]
+        chunks = [resampler.process(samples[a:b]) for a, b in zip(cuts, cuts[1:])]
+        chunks.append(resampler.process(audio.EMPTY, final=True))
+        assert np.array_equal(np.concatenate(chunks), resampled)
+
+
+def test_resampling_filters_what_16khz_cant_hold():
+    resampled = audio.resample(sine(12000, 44100), 44100)
+    assert np.abs(resampled[100:-100]).max() < 200
+
+
+def test_stereo_44khz_wav_becomes_16khz_mono_pcm():
+    stereo = np.stack([sine(440, 44100), sine(440, 44100)], axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(stereo.tobytes())
+
+    pcm = audio.to_16k_pcm(buffer.getvalue(), "audio/wav")
+    assert len(pcm) == audio.SAMPLE_RATE * audio.SAMPLE_WIDTH
+
+    wav = audio.to_wav(pcm)
+    info = audio.parse_wav_header(wav)
+    assert info.is_device_format
+    # Already in the right format, so passed through without a copy
+    passed_through = audio.to_16k_pcm(wav, "audio/webm")
+    assert passed_through.obj is wav
+    assert passed_through == pcm
@@ -0,0 +1,72 @@
+from source.utils import audio_frames
+from source.utils.audio_frames import FLAG_LAST, Framer, negotiate, pack, unpack
+
+
+def test_headers_round_trip():
+    frame = pack(b"\1\2\3\4", 7, last=True, sample_rate=24000, channels=2)
+    assert len(frame) == audio_frames.HEADER.size + 4
+
+    header, payload = unpack(frame)
+    assert header == (audio_frames.VERSION, FLAG_LAST, 2, 24000, 7)
+    assert payload == b"\1\2\3\4"
+
+
+def test_frames_are_numbered_per_utterance_and_only_the_last_is_flagged():
+    settings = negotiate({"audio_framing": "framed", "frame_ms": 20})
+    size = audio_frames.frame_size(20)
+    assert size == 640
+    framer = Framer(settings)
+
+    for utterance in range(2):
+        # Two and a half frames, arriving in pieces that don't line up with them
+        pcm = bytes(range(256)) * 10
+        pcm = pcm[: size * 5 // 2]
+        frames = framer.feed(pcm[:1000]) + framer.feed(pcm[1000:]) + framer.flush()
+
+        headers, payloads = zip(*(unpack(frame) for frame in frames))
+        assert [header.sequence for header in headers] == [0, 1, 2]
+        assert [header.flags for header in headers] == [0, 0, FLAG_LAST]
+        assert [len(payload) for payload in payloads] == [size, size, size // 2]
+        assert b"".join(payloads) == pcm
+
+    # An utterance that ends on a frame boundary still gets its last frame flagged
+    frames = framer.feed(bytes(size * 2)) + framer.flush()
+    assert [unpack(frame)[0].flags for frame in frames] == [0, FLAG_LAST]
+
+
+def test_raw_devices_get_bare_slices():
+    frames = audio_frames.split(bytes(2500), negotiate({}))
+    assert [len(frame) for frame in frames] == [1024, 1024, 452]
+
+
+def test_negotiation_sticks_to_what_the_server_supports():
+    settings = negotiate(
+        {
+            "audio_framing": "framed",
+            "frame_ms": 5,
+            "sample_rate": 48000,
+            "channels": 2,
+            "input_formats": ["bytes.flac", "bytes.opus", "bytes.wav"],
+        },
+        input_formats=("bytes.opus", "bytes.wav"),
+    )
+    assert settings == {
+        "audio_framing": "framed",
+        "frame_ms": audio_frames.MIN_FRAME_MS,
+        "sample_rate": 16000,
+        "channels": 1,
+        "sample_format": "s16le",
+        "input_format": "bytes.opus",
+    }
+
+    assert negotiate({"audio_framing": "framed", "frame_ms": 1000})["frame_ms"] == (
+        audio_frames.MAX_FRAME_MS
+    )
+    assert negotiate({"audio_framing": "framed", "frame_ms": "soon"})["frame_ms"] == (
+        audio_frames.DEFAULT_FRAME_MS
+    )
+    # Nothing we can read, so it records what every device can
+    assert negotiate({"input_formats": ["bytes.flac"]}) == {
+        **audio_frames.RAW,
+        "input_format": audio_frames.DEFAULT_INPUT_FORMAT,
+    }
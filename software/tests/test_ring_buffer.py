@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+from source.utils.ring_buffer import JitterBuffer, RingBuffer
+
+
+def test_wraps_around_and_overwrites_the_oldest():
+    ring = RingBuffer(8)
+    assert ring.write(b"abcdef") == 6
+    assert ring.read(4) == b"abcd"
+    # Only what fits, unless the oldest may go
+    assert ring.write(b"ghijklmn") == 6
+    assert ring.read(100) == b"efghijkl"
+    assert ring.write(b"0123456789", overwrite=True) == 8
+    ring.write(b"xy", overwrite=True)
+    assert len(ring) == 8
+    assert ring.read(8) == b"456789xy"
+    ring.write(b"abcdef")
+    assert ring.keep_last(2) == 2
+    assert ring.read(8) == b"ef"
+
+
+def test_playback_waits_for_the_prebuffer():
+    jitter = JitterBuffer(64, prebuffer=8)
+    out = bytearray(4)
+
+    jitter.begin()
+    jitter.write(b"abcd")
+    jitter.fill(out)
+    assert out == bytes(4)
+
+    jitter.write(b"efgh")
+    jitter.fill(out)
+    assert out == b"abcd"
+    jitter.fill(out)
+    assert out == b"efgh"
+
+    # Runs dry, so it buffers again, unless that was the end
+    jitter.write(b"ij")
+    jitter.fill(out)
+    assert out == b"ij\0\0"
+    jitter.write(b"kl")
+    jitter.fill(out)
+    assert out == bytes(4)
+    jitter.end()
+    jitter.fill(out)
+    assert out == b"kl\0\0"
+
+
+def test_a_full_buffer_wakes_the_writer_once_some_is_played():
+    jitter = JitterBuffer(8, prebuffer=4)
+    jitter.begin()
+    out = bytearray(4)
+
+    async def play():
+        written = jitter.write(b"0123456789")
+        # Played by the audio callback's thread
+        threading.Timer(0.01, jitter.fill, [out]).start()
+        await asyncio.wait_for(jitter.wait_for_space(), 1)
+        written += jitter.write(b"89")
+        # Cleared while we wait, so even a callback that plays nothing wakes us
+        threading.Timer(0.01, jitter.clear).start()
+        threading.Timer(0.02, jitter.fill, [bytearray(0)]).start()
+        await asyncio.wait_for(jitter.wait_for_space(), 1)
+        return written
+
+    assert asyncio.run(play()) == 10
+    assert out == b"0123"
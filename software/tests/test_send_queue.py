@@ -0,0 +1,27 @@
+import asyncio
+import threading
+
+from source.utils.send_queue import SendQueue
+
+
+def test_batches_waiting_audio_and_wakes_up_for_other_threads():
+    queue = SendQueue(max_batch=6)
+    start = {"role": "user", "type": "audio", "start": True}
+    for message in [start, b"ab", b"cd", b"ef", b"gh", {"end": True}, b"ij"]:
+        queue.put(message)
+
+    async def receive():
+        received = [await queue.get() for _ in range(5)]
+        # Nothing's waiting now, so this waits for the recorder thread
+        threading.Timer(0.01, queue.put, [b"late"]).start()
+        received.append(await asyncio.wait_for(queue.get(), 1))
+        return received
+
+    assert asyncio.run(receive()) == [
+        start,
+        b"abcdef",
+        b"gh",
+        {"end": True},
+        b"ij",
+        b"late",
+    ]